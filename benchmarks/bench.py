@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Benchmarks of common reorganization workloads on synthetic collections
+
+Runs each scenario through the headless engine on a fresh copy of a
+generated collection and reports wall time, SQL statements and rows
+written, as recorded by the profiler.
+
+Usage (anki needs to be importable, e.g. via PYTHONPATH):
+
+    python benchmarks/bench.py [--sizes 1000,10000] [--scenarios move_top]
+
+Generated collections are cached in benchmarks/data, profiler reports
+are written to benchmarks/results.
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+from collections import OrderedDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from anki import Collection
+
+from note_organizer.consts import *
+from note_organizer.engine import Engine
+from note_organizer.profiler import Profiler
+from note_organizer.ops import Op, noteOps, diffOps
+
+from synthetic import DISTRIBUTIONS, ensureCollection
+
+SIZES = (1000, 10000, 100000, 1000000)
+# Number of notes affected by bulk scenarios
+BULK_COUNT = 500
+# Number of notes in a moved block
+BLOCK_SIZE = 100
+# Date shift in seconds
+SHIFT_OFFSET = -86400
+
+MODES = ("full", "diff")
+
+
+def spread(nids, count=BULK_COUNT):
+    """Return every n-th nid so that count nids are picked evenly"""
+    step = max(1, len(nids) // count)
+    return set(nids[::step][:count])
+
+
+def moveTop(nids):
+    """Move a note from the middle of the collection to the top"""
+    nid = nids[len(nids) // 2]
+    return noteOps([nid] + [n for n in nids if n != nid]), [nid]
+
+
+def moveBlock(nids):
+    """Move a block of notes from the last quarter to the first one"""
+    src = len(nids) * 3 // 4
+    block = nids[src:src + BLOCK_SIZE]
+    dest = len(nids) // 4
+    order = nids[:dest] + block + nids[dest:src] + nids[src + BLOCK_SIZE:]
+    return noteOps(order), block
+
+
+def inserts(nids):
+    """Insert new notes in front of evenly spread notes"""
+    picked = spread(nids)
+    ops = []
+    for nid in nids:
+        if nid in picked:
+            ops.append(Op(ROW_NEW, 0, MODEL_SAME))
+        ops.append(Op(ROW_NOTE, nid))
+    return ops, []
+
+
+def deletes(nids):
+    """Delete evenly spread notes"""
+    picked = spread(nids)
+    return [Op(ROW_DEL if nid in picked else ROW_NOTE, nid)
+            for nid in nids], []
+
+
+def dupesSched(nids):
+    """Duplicate evenly spread notes alongside their scheduling"""
+    picked = spread(nids)
+    ops = []
+    for nid in nids:
+        ops.append(Op(ROW_NOTE, nid))
+        if nid in picked:
+            ops.append(Op(ROW_DUPE_SCHED, nid))
+    return ops, []
+
+
+# name: function returning (ops, moved), None for date shifts
+SCENARIOS = OrderedDict((
+    ("move_top", moveTop),
+    ("move_block", moveBlock),
+    ("shift", None),
+    ("insert_500", inserts),
+    ("delete_500", deletes),
+    ("dupe_sched_500", dupesSched),
+))
+
+
+def runScenario(path, name, mode, results):
+    """Run scenario on a copy of the collection at path"""
+    work = os.path.join(os.path.dirname(path), "work.anki2")
+    shutil.copy(path, work)
+    col = Collection(work)
+    try:
+        col.modSchema(check=False)
+        nids = col.db.list("select id from notes order by id")
+        label = "{}-{}-{}".format(
+            os.path.basename(path)[:-len(".anki2")], name, mode)
+        profiler = Profiler(label, col, enabled=True, folder=results)
+        engine = Engine(col, profiler)
+        builder = SCENARIOS[name]
+        ops, moved = builder(nids) if builder else (None, None)
+        with profiler:
+            if builder is None:
+                engine.shift(nids, nids[0] // 1000 + SHIFT_OFFSET)
+            elif mode == "diff":
+                anchors, hunks = diffOps(ops, set(moved))
+                engine.reorganizeHunks(anchors, hunks, moved)
+            else:
+                engine.reorganize(ops, None, moved)
+    finally:
+        col.close(save=False)
+        os.remove(work)
+    return profiler.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark reorganization workloads")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)),
+        help="comma-separated note counts (default: %(default)s)")
+    parser.add_argument("--distributions", default=",".join(DISTRIBUTIONS),
+        help="comma-separated nid distributions (default: %(default)s)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+        help="comma-separated scenarios (default: %(default)s)")
+    parser.add_argument("--modes", default=",".join(MODES),
+        help="comma-separated engine paths (default: %(default)s)")
+    parser.add_argument("--data", default=os.path.join(HERE, "data"),
+        help="folder to cache generated collections in")
+    parser.add_argument("--results", default=os.path.join(HERE, "results"),
+        help="folder to write profiler reports to")
+    args = parser.parse_args(argv)
+
+    sizes = [int(i) for i in args.sizes.split(",")]
+    distributions = args.distributions.split(",")
+    scenarios = args.scenarios.split(",")
+    modes = args.modes.split(",")
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error("unknown scenario: {}".format(name))
+
+    row = "{:>8} {:>7} {:>15} {:>5} {:>10} {:>11} {:>10}"
+    print(row.format("notes", "nids", "scenario", "mode",
+                     "time (s)", "statements", "rows"))
+    summary = []
+    for size in sizes:
+        for distribution in distributions:
+            path = ensureCollection(args.data, size, distribution)
+            for name in scenarios:
+                # date shifts don't have a diff path
+                for mode in (modes if SCENARIOS[name] else modes[:1]):
+                    report = runScenario(path, name, mode, args.results)
+                    summary.append(OrderedDict((
+                        ("notes", size), ("nids", distribution),
+                        ("scenario", name), ("mode", mode),
+                        ("time", report["time"]),
+                        ("statements", report["statements"]),
+                        ("rows", report["rows"]))))
+                    print(row.format(size, distribution, name, mode,
+                        "{:.3f}".format(report["time"]),
+                        report["statements"], report["rows"]))
+                    sys.stdout.flush()
+
+    if not os.path.isdir(args.results):
+        os.makedirs(args.results)
+    with open(os.path.join(args.results, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Synthetic collections for benchmarking
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+import os
+import random
+
+from anki import Collection
+from anki.utils import guid64, fieldChecksum, intTime
+
+# 2017-01-01 00:00 UTC in ms, first nid of generated collections
+BASE_NID = 1483228800000
+# Average gap between sparse nids in ms (~1 note per minute)
+SPARSE_GAP = 60000
+# Share of notes that use a model with two card templates
+TWO_CARD_SHARE = 0.5
+# Share of cards that are in review
+REVIEW_SHARE = 0.3
+# Rows per executemany call while generating
+GEN_CHUNK_SIZE = 10000
+
+DISTRIBUTIONS = ("dense", "sparse")
+
+
+def generateNids(count, distribution, seed=0):
+    """
+    Return sorted nids
+
+    - dense:  consecutive milliseconds, no room in between notes,
+              e.g. notes created by an importer
+    - sparse: random gaps averaging SPARSE_GAP,
+              e.g. notes added by hand over time
+    """
+    if distribution == "dense":
+        return list(range(BASE_NID, BASE_NID + count))
+    rnd = random.Random(seed)
+    nids = []
+    nid = BASE_NID
+    for i in range(count):
+        nids.append(nid)
+        nid += rnd.randint(1, 2 * SPARSE_GAP)
+    return nids
+
+
+def collectionPath(folder, count, distribution):
+    return os.path.join(folder, "bench-{}-{}.anki2".format(
+        count, distribution))
+
+
+def createCollection(path, count, distribution, seed=0):
+    """
+    Create collection at path with count notes. Notes and cards are
+    written in bulk instead of through col.addNote, which would take
+    hours for the larger sizes.
+    """
+    rnd = random.Random(seed)
+    col = Collection(path)
+    try:
+        basic = col.models.byName("Basic")
+        reversed_ = col.models.byName("Basic (and reversed card)") or basic
+        did = 1
+        mod = intTime()
+        today = col.sched.today
+        notes = []
+        cards = []
+        cid = BASE_NID
+        position = 0
+        for nid in generateNids(count, distribution, seed):
+            model = reversed_ if rnd.random() < TWO_CARD_SHARE else basic
+            front = u"Front {}".format(nid)
+            flds = u"\x1f".join([front] + [u""] * (len(model['flds']) - 1))
+            notes.append((nid, guid64(), model['id'], mod, -1, u"",
+                          flds, front, fieldChecksum(front), 0, u""))
+            position += 1
+            for tmpl in range(len(model['tmpls'])):
+                if rnd.random() < REVIEW_SHARE:
+                    ivl = rnd.randint(1, 365)
+                    cards.append((cid, nid, did, tmpl, mod, -1, 2, 2,
+                        today + rnd.randint(0, ivl), ivl, 2500,
+                        rnd.randint(1, 20), rnd.randint(0, 3), 0, 0, 0, 0, u""))
+                else:
+                    cards.append((cid, nid, did, tmpl, mod, -1, 0, 0,
+                        position, 0, 0, 0, 0, 0, 0, 0, 0, u""))
+                cid += 1
+            if len(notes) >= GEN_CHUNK_SIZE:
+                insertRows(col, notes, cards)
+                notes = []
+                cards = []
+        insertRows(col, notes, cards)
+        col.conf['nextPos'] = position + 1
+        col.setMod()
+        col.save()
+    finally:
+        col.close()
+    return path
+
+
+def insertRows(col, notes, cards):
+    col.db.executemany(
+        "insert into notes values (?,?,?,?,?,?,?,?,?,?,?)", notes)
+    col.db.executemany(
+        "insert into cards values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+        cards)
+
+
+def ensureCollection(folder, count, distribution):
+    """Return path of generated collection, creating it if needed"""
+    path = collectionPath(folder, count, distribution)
+    if not os.path.exists(path):
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        tmp = path + ".tmp.anki2"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        createCollection(tmp, count, distribution)
+        os.rename(tmp, path)
+    return path
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Gap-aware note ID allocator
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+from bisect import bisect_right
+
+# Number of free nids to leave behind an allocation when possible
+ROOM = 20
+
+
+class GapExhausted(Exception):
+    """Raised when a gap can't fit the requested number of nids"""
+
+    def __init__(self, lo, hi, needed, available):
+        super(GapExhausted, self).__init__(
+            "Only {} free nid(s) between {} and {}, {} needed".format(
+                available, lo, hi, needed))
+        self.lo = lo
+        self.hi = hi
+        self.needed = needed
+        self.available = available
+
+
+class NidAllocator(object):
+    """
+    Hands out unassigned note IDs based on a NidIndex
+
+    Free nids are never stored explicitly. They are modeled as the
+    intervals between the occupied nids of the index, which allows
+    counting and addressing them with binary searches alone.
+    Allocated nids are marked as occupied in the index right away.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+
+    def countFree(self, lo, hi):
+        """Return number of free nids within (lo, hi)"""
+        if hi <= lo + 1:
+            return 0
+        return hi - lo - 1 - self.index.countBetween(lo, hi)
+
+
+    def nthFree(self, lo, n):
+        """Return the n-th (0-based) free nid > lo"""
+        nids = self.index.nids
+        first = bisect_right(nids, lo)
+        target = lo + 1 + n
+        # find the number k of occupied nids that precede the result,
+        # i.e. the smallest k with nids[first+k] > target + k
+        k_lo, k_hi = 0, len(nids) - first
+        while k_lo < k_hi:
+            k = (k_lo + k_hi) // 2
+            if nids[first+k] - k > target:
+                k_hi = k
+            else:
+                k_lo = k + 1
+        return target + k_lo
+
+
+    def allocate(self, start):
+        """
+        Reserve first free nid >= start, moving it forward to leave some
+        room for future changes when possible
+        """
+        index = self.index
+        nid = index.nextFree(start)
+        gap = index.gapAfter(nid)
+        if gap is None or gap > ROOM:
+            gap = ROOM
+        nid += gap
+        index.add(nid)
+        return nid
+
+
+    def allocateBefore(self, end):
+        """
+        Reserve last free nid <= end, moving it backward to leave some
+        room for future changes when possible
+        """
+        index = self.index
+        nid = index.prevFree(end)
+        gap = index.gapBefore(nid)
+        if gap is None or gap > ROOM:
+            gap = ROOM
+        nid -= gap
+        index.add(nid)
+        return nid
+
+
+    def spread(self, lo, hi, count):
+        """
+        Reserve count free nids within (lo, hi), distributed evenly
+        across the free space of the gap
+
+        Raises GapExhausted if the gap is too small. Without an upper
+        bound (hi is None) nids are allocated consecutively after lo,
+        without a lower bound (lo is None) consecutively before hi.
+        """
+        if lo is None:
+            nids = []
+            last = hi
+            for i in range(count):
+                last = self.allocateBefore(last - 1)
+                nids.append(last)
+            nids.reverse()
+            return nids
+
+        if hi is None:
+            nids = []
+            last = lo
+            for i in range(count):
+                last = self.allocate(last + 1)
+                nids.append(last)
+            return nids
+
+        available = self.countFree(lo, hi)
+        if available < count:
+            raise GapExhausted(lo, hi, count, available)
+
+        nids = [self.nthFree(lo, ((i + 1) * (available + 1)) // (count + 1) - 1)
+                    for i in range(count)]
+        for nid in nids:
+            self.index.add(nid)
+        return nids
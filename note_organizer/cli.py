@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Command line interface to the reorganization engine
+
+Usage:
+
+    python -m note_organizer.cli collection.anki2 order.txt [--start DATE]
+
+The note order lists one row per line in the format of the first
+column of the Organizer, e.g.:
+
+    1498762346137
+    New: Basic
+    Dupe: 1498762346137
+    Dupe (sched): 1498762346137
+    Del: 1498762351235
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+import sys
+import time
+import json
+import argparse
+
+from anki import Collection
+
+from .consts import *
+from .engine import Engine
+from .profiler import Profiler
+from .ops import Op
+
+KINDS = {
+    NEW_NOTE: ROW_NEW,
+    DUPE_NOTE: ROW_DUPE,
+    DUPE_NOTE_SCHED: ROW_DUPE_SCHED,
+    DEL_NOTE: ROW_DEL
+}
+
+
+def parseOps(lines):
+    """Parse note order in the format of the first Organizer column"""
+    ops = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if ":" not in line:
+            ops.append(Op(ROW_NOTE, int(line)))
+            continue
+        label, value = [i.strip() for i in line.split(":", 1)]
+        kind = KINDS.get(label)
+        if kind is None:
+            raise ValueError("Unknown row: {}".format(line))
+        if kind == ROW_NEW:
+            ops.append(Op(kind, 0, value or MODEL_SAME))
+        else:
+            ops.append(Op(kind, int(value)))
+    return ops
+
+
+def parseDate(value):
+    """Parse 'YYYY-MM-DD HH:MM' or a UNIX timestamp"""
+    if value.isdigit():
+        return int(value)
+    return int(time.mktime(time.strptime(value, "%Y-%m-%d %H:%M")))
+
+
+def run(col, ops, start=None, repos=False, profiler=None):
+    """
+    Reorganize notes of col according to ops, only shifting them if
+    the order itself is unchanged. Returns ChangeSet
+    """
+    engine = Engine(col, profiler)
+    nids = [op.nid for op in ops]
+    if nids and start == nids[0] // 1000:
+        start = None # first note already created at that time
+    if (start and all(op.kind == ROW_NOTE for op in ops)
+            and nids == sorted(nids)):
+        return engine.shift(nids, start, repos)
+    return engine.reorganize(ops, start, repos=repos)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reorganize notes of an Anki collection")
+    parser.add_argument("collection", help="path to collection file")
+    parser.add_argument("order", help="note order file, '-' for stdin")
+    parser.add_argument("--start",
+        help="creation date of first note, 'YYYY-MM-DD HH:MM' "
+             "or UNIX timestamp")
+    parser.add_argument("--reposition", action="store_true",
+        help="reposition new cards")
+    parser.add_argument("--profile", action="store_true",
+        help="record timings and SQL statement counts")
+    args = parser.parse_args(argv)
+
+    if args.order == "-":
+        ops = parseOps(sys.stdin)
+    else:
+        with open(args.order) as f:
+            ops = parseOps(f)
+    start = parseDate(args.start) if args.start else None
+
+    col = Collection(args.collection)
+    done = False
+    try:
+        # Reorganizing notes requires a full sync
+        col.modSchema(check=False)
+        profiler = Profiler("cli", col, enabled=args.profile)
+        with profiler:
+            changes = run(col, ops, start, args.reposition, profiler)
+        done = True
+    finally:
+        # partial changes are rolled back
+        col.close(save=done)
+
+    report = changes.report()
+    if profiler.enabled:
+        report["profile"] = profiler.report()
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
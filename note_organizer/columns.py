@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Lazy browser column rendering
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+from collections import OrderedDict
+
+from aqt.qt import *
+from anki.utils import ids2str
+
+# Maximum number of cached cell values
+CACHE_SIZE = 20000
+
+# Marker for values that haven't been rendered yet
+MISSING = object()
+
+
+class LRUCache(object):
+    """Bounded mapping that evicts the least recently used entries"""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.data = OrderedDict()
+
+
+    def __len__(self):
+        return len(self.data)
+
+
+    def __contains__(self, key):
+        return key in self.data
+
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            return default
+        self.data[key] = value
+        return value
+
+
+    def put(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        if len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+
+    def pop(self, key, default=None):
+        return self.data.pop(key, default)
+
+
+    def clear(self):
+        self.data.clear()
+
+
+class BrowserColumns(object):
+    """
+    Renders the active browser columns of individual cards on demand.
+    Values are cached by (cid, column type, card modification time),
+    so that edited cards are rendered again.
+    """
+
+    def __init__(self, browser, size=CACHE_SIZE):
+        self.model = browser.model
+        self.cache = LRUCache(size)
+        self.mods = {} # cid: mod
+        self.cards = None # browser card list self.rows was built for
+        self.rows = {} # cid: browser row
+
+
+    def invalidate(self):
+        """Forget card modification times, e.g. after a collection reset"""
+        self.mods = {}
+        self.cards = None
+        self.rows = {}
+
+
+    def forget(self, cids):
+        """Render cids again, e.g. after they or their notes were modified"""
+        ctypes = self.model.activeCols
+        for cid in cids:
+            mod = self.mods.pop(cid, None)
+            if mod is None:
+                continue
+            for ctype in ctypes:
+                self.cache.pop((cid, ctype, mod))
+
+
+    def browserRow(self, cid):
+        """Return row of cid in the browser table or None if not shown"""
+        # rebuilt only when the browser replaced its card list, e.g. on
+        # a new search, not for every card that isn't shown
+        cards = self.model.cards
+        if cards is not self.cards or len(cards) != len(self.rows):
+            self.cards = cards
+            self.rows = dict((c, r) for r, c in enumerate(cards))
+        return self.rows.get(cid)
+
+
+    def get(self, cid, col):
+        """Return cached value of column col for cid or MISSING"""
+        mod = self.mods.get(cid)
+        if mod is None:
+            return MISSING
+        return self.cache.get((cid, self.model.activeCols[col], mod), MISSING)
+
+
+    def fetch(self, cids):
+        """Render all columns of cids that aren't cached yet"""
+        missing = [cid for cid in cids if cid not in self.mods]
+        if missing:
+            self.mods.update(self.model.col.db.all(
+                "select id, mod from cards where id in " + ids2str(missing)))
+            for cid in missing:
+                self.mods.setdefault(cid, 0) # card deleted
+        m = self.model
+        cache = self.cache
+        for cid in cids:
+            mod = self.mods[cid]
+            row = None
+            for col, ctype in enumerate(m.activeCols):
+                key = (cid, ctype, mod)
+                if key in cache:
+                    continue
+                if row is None:
+                    row = self.browserRow(cid)
+                if row is None: # card not shown in browser anymore
+                    value = u""
+                else:
+                    value = m.data(m.index(row, col), Qt.DisplayRole)
+                cache.put(key, value)
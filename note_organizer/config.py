@@ -27,10 +27,14 @@ HOTKEY_PASTE = "Ctrl+V"
 
 # Ask confirmation before performing actions
 ASK_CONFIRMATION = True
-# Display warning when invoking on more than x cards
-CARD_COUNT_WARNING = 2000
 # Default note type of created notes
 DEFAULT_MODEL = "Basic"
+# Record timings of individual processing phases and write them
+# to a JSON report after each run:
+PROFILING = False
+# folder to write profiling reports to (default: "profiles"
+# folder in add-on directory):
+PROFILING_DIR = None
 
 # Reviewer context actions
 
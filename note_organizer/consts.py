@@ -9,9 +9,16 @@ Copyright: (c) Glutanimate 2017
 License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
 """
 
-# Global variables
+# Labels of Organizer action rows
 NEW_NOTE = "New"
 DUPE_NOTE = "Dupe"
 DUPE_NOTE_SCHED = "Dupe (sched)"
 DEL_NOTE = "Del"
 MODEL_SAME = "Same note type as previous"
+
+# Row types of the Organizer table
+ROW_NOTE = 0
+ROW_NEW = 1
+ROW_DUPE = 2
+ROW_DUPE_SCHED = 3
+ROW_DEL = 4
@@ -0,0 +1,776 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Headless reorganization engine
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+from collections import OrderedDict
+
+from anki.notes import Note
+from anki.utils import intTime, ids2str
+
+from .config import *
+from .consts import *
+from .nidindex import NidIndex
+from .allocator import NidAllocator, GapExhausted
+from .planner import Plan, Planner
+from .executor import NidRemapper, FieldWriter, SchedulingCopier, chunks
+from .profiler import Profiler
+from .ops import Op, Hunk, noteOps
+
+# Number of neighbouring notes to look up at a time for localized inserts
+NEIGHBOURS = 20
+# Number of anchors to take in at most while looking for room around a
+# segment, before widening it up to the end of the note order
+WIDEN_LIMIT = 1000
+
+
+class ChangeSet(object):
+    """
+    Report of a reorganization. Also passed to the "noteOrganizer.changed"
+    hook, so that views can update the affected rows and cards only.
+
+    - nid_map:      dict, old nid: new nid of renumbered notes
+    - moved:        list, nids that were requested to be moved
+    - modified:     list, renumbered nids of existing notes
+    - created:      list, nids of created notes
+    - deleted:      list, nids of deleted notes
+    - deleted_cids: list, cids of the cards of deleted notes
+    - shifted:      int, number of notes shifted by a constant offset
+    - sched:        boolean, whether scheduling was changed, i.e. whether
+                    the collection needs to be reset as a whole
+    """
+
+    def __init__(self, nid_map, moved=(), modified=(), created=(), deleted=(),
+                 deleted_cids=(), shifted=0, sched=False):
+        self.nid_map = nid_map
+        self.moved = list(moved)
+        self.modified = list(modified)
+        self.created = list(created)
+        self.deleted = list(deleted)
+        self.deleted_cids = list(deleted_cids)
+        self.shifted = shifted
+        self.sched = sched
+
+
+    def report(self):
+        """Return summary as a dictionary"""
+        return OrderedDict((
+            ("moved", len(self.moved)),
+            ("modified", len(self.modified)),
+            ("updated_alongside",
+                len(set(self.modified).difference(self.moved))),
+            ("created", len(self.created)),
+            ("deleted", len(self.deleted)),
+            ("shifted", self.shifted),
+            ("sched", self.sched),
+            ("nid_map", dict((str(nid), new_nid)
+                             for nid, new_nid in self.nid_map.items()))
+        ))
+
+
+class Engine(object):
+    """
+    Performs the actual database reorganization on a collection,
+    without depending on the GUI
+
+    Callers are responsible for marking the schema as modified, creating
+    checkpoints and resetting the collection afterwards if the returned
+    ChangeSet has its sched flag set. See Rearranger for the Qt adapter.
+    """
+
+    def __init__(self, col, profiler=None, card=None, visible=None):
+        """
+        Arguments:
+
+        - col:      Anki collection
+        - profiler: Profiler whose phases to record, if any
+        - card:     Card whose deck to create new notes in, e.g. the card
+                    shown in the reviewer
+        - visible:  iterable, cids to prefer when picking the card whose
+                    deck to create new notes in, e.g. cards shown in the
+                    browser
+        """
+        self.col = col
+        self.profiler = profiler or Profiler("engine", col, enabled=False)
+        self.card = card
+        self.visible = visible
+        self.visible_set = None
+        self.nid_map = {}
+        self.deleted_cids = []
+        self.sched_changed = False
+        self.index = None
+        self.allocator = None
+
+
+    def reorganize(self, ops, start=None, moved=(), repos=False):
+        """
+        Bring notes into the order given by ops
+
+        Arguments:
+
+        - ops:   list, Op tuples in the requested order, i.e. existing
+                 notes and actions (new notes, dupes, deletions)
+        - start: int, creation date of first note as UNIX timestamp
+        - moved: list, nids that were interactively moved by the user
+        - repos: boolean, whether to reposition due dates or not
+
+        Returns ChangeSet
+        """
+        moved = list(moved)
+        profiler = self.profiler
+        self.loadIndex()
+        with profiler.phase("actions"):
+            nids, deleted, created = self.processActions(ops)
+        with profiler.phase("plan"):
+            plan = Planner(self.allocator).plan(nids, start, moved,
+                                                created=created)
+        modified = self.applyPlan(plan, created)
+
+        profiler.meta.update(notes=len(nids), moved=len(moved),
+            deleted=len(deleted), created=len(created),
+            modified=len(modified))
+
+        return self.finish(plan.nidlist, repos, moved, modified,
+                           created, deleted)
+
+
+    def reorganizeHunks(self, anchors, hunks, moved=(), repos=False,
+                        more=None, floor=-1):
+        """
+        Alternative to reorganize that only processes the changed parts
+        of a note order, as computed by ops.diffOps. Unchanged notes act
+        as bounds of the hunks surrounding them and are only renumbered
+        if a hunk doesn't fit in between.
+
+        Arguments:
+
+        - anchors: list, nids of unchanged notes, strictly increasing
+        - hunks:   list, Hunk tuples of changed rows
+        - moved:   list, nids that were interactively moved by the user
+        - repos:   boolean, whether to reposition due dates or not
+        - more:    function, more(nid, limit) returns up to limit
+                   unchanged notes following nid (all of them if limit
+                   is -1), if anchors only cover part of the note order
+        - floor:   int, index of the lowest anchor that notes may be
+                   moved in front of, -1 if anchors start at the
+                   beginning of the note order
+
+        Returns ChangeSet
+        """
+        if not anchors:
+            # every note is part of a hunk
+            return self.reorganize([op for hunk in hunks for op in hunk.ops],
+                                   None, moved, repos)
+        moved = list(moved)
+        profiler = self.profiler
+        # only load nids between the outermost anchors of the hunks,
+        # and those of the changed rows themselves
+        first = max(min(hunk.anchor for hunk in hunks), 0)
+        last = min(max(hunk.anchor for hunk in hunks) + 1, len(anchors) - 1)
+        self.loadIndex(anchors[first], anchors[last],
+            [op.nid for hunk in hunks for op in hunk.ops if op.nid])
+        with profiler.phase("actions"):
+            # hunks with their surrounding anchors, which also serve
+            # as samples for new notes
+            ops = []
+            last = None
+            for hunk in hunks:
+                if hunk.anchor >= 0 and hunk.anchor != last:
+                    ops.append(Op(ROW_NOTE, anchors[hunk.anchor]))
+                ops.extend(hunk.ops)
+                last = hunk.anchor + 1
+                if last < len(anchors):
+                    ops.append(Op(ROW_NOTE, anchors[last]))
+            nids, deleted, created = self.processActions(ops)
+
+            # split into (lower anchor idx, upper anchor idx, nids)
+            positions = dict((anchors[hunk.anchor], hunk.anchor)
+                             for hunk in hunks if hunk.anchor >= 0)
+            positions.update((anchors[hunk.anchor + 1], hunk.anchor + 1)
+                             for hunk in hunks
+                             if hunk.anchor + 1 < len(anchors))
+            segments = []
+            lower = -1
+            current = []
+            for nid in nids:
+                pos = positions.get(nid)
+                if pos is None:
+                    current.append(nid)
+                    continue
+                if current:
+                    segments.append((lower, pos, current))
+                    current = []
+                lower = pos
+            if current:
+                segments.append((lower, len(anchors), current))
+
+        with profiler.phase("plan"):
+            plan = self.planSegments(segments, anchors, moved, created,
+                                     more, floor)
+
+        modified = self.applyPlan(plan, created)
+
+        profiler.meta.update(notes=len(nids), anchors=len(anchors),
+            hunks=len(hunks), moved=len(moved), deleted=len(deleted),
+            created=len(created), modified=len(modified))
+
+        return self.finish(plan.nidlist, repos, moved, modified,
+                           created, deleted)
+
+
+    def planSegments(self, segments, anchors, moved, created, more=None,
+                     floor=-1):
+        """
+        Plan each segment between its anchors. Segments that don't fit
+        are widened once, see widen, and all notes of the widened window
+        are spread across its free nids.
+        """
+        plan = Plan()
+        created = set(created)
+        planner = Planner(self.allocator)
+        index = self.index
+        exhausted = [not more]
+
+        def extend(limit):
+            """Fetch more anchors, return False if there are none left"""
+            if exhausted[0]:
+                return False
+            nids = more(anchors[-1], limit)
+            exhausted[0] = limit == -1 or len(nids) < limit
+            anchors.extend(nid for nid in nids if nid not in created)
+            return bool(nids)
+
+        bottom = floor # windows can't reach below previous segments
+        idx = 0
+        while idx < len(segments):
+            lower, upper, nids = segments[idx]
+            idx += 1
+            keep = True
+            while True:
+                index.ensure(anchors[max(lower, 0)],
+                             anchors[min(upper, len(anchors) - 1)])
+                index.begin()
+                try:
+                    part = planner.plan(nids, None, moved,
+                        anchors[lower] if lower >= 0 else None,
+                        anchors[upper] if upper < len(anchors) else None,
+                        created, keep)
+                except GapExhausted:
+                    index.rollback()
+                    if not keep: # window was checked to fit
+                        raise
+                    lower, upper, nids, idx = self.widen(segments, idx,
+                        lower, upper, nids, anchors, bottom, extend)
+                    keep = False
+                    continue
+                index.commit()
+                break
+            bottom = upper
+            plan.assignments.extend(part.assignments)
+            plan.nidlist.extend(part.nidlist)
+        return plan
+
+
+    def widen(self, segments, idx, lower, upper, nids, anchors, bottom,
+              extend):
+        """
+        Find the nearest window around a segment that has enough free
+        nids for it, either by taking in anchors above the segment,
+        merging with the segments that follow, or anchors below it, down
+        to bottom. Window sizes are probed with exponentially growing
+        steps, then narrowed down with a binary search, so that only a
+        logarithmic number of windows needs to be counted.
+
+        Returns (lower, upper, nids, idx) of the widened segment, idx
+        being the index of the next segment that is left to plan
+        """
+        index = self.index
+        pending = segments[idx:]
+
+        def merged(b):
+            """Nids of segment and the pending segments below anchor b"""
+            group = list(nids)
+            for seg in pending:
+                if seg[0] >= b:
+                    break
+                group.extend(seg[2])
+            return group
+
+        def fits(a, b, group):
+            if a < 0 or b >= len(anchors):
+                return True # unbounded
+            lo = anchors[a]
+            hi = anchors[b]
+            free = self.allocator.countFree(lo, hi)
+            needed = 0
+            for nid in group:
+                if nid in index and not lo < nid < hi:
+                    needed += 1
+            return free >= needed
+
+        def fitsUp(b):
+            return fits(lower, b, merged(b))
+
+        def fitsDown(a):
+            return fits(a, upper, nids)
+
+        # below: gallop to a window that fits, then bisect
+        a = None
+        failed = lower
+        step = 1
+        while lower - step >= bottom and step <= WIDEN_LIMIT:
+            if fitsDown(lower - step):
+                a = lower - step
+                break
+            failed = lower - step
+            step *= 2
+        else:
+            if lower > bottom and lower - bottom <= WIDEN_LIMIT and \
+                    fitsDown(bottom):
+                a = bottom
+        if a is not None:
+            while a + 1 < failed:
+                mid = (a + failed) // 2
+                if fitsDown(mid):
+                    a = mid
+                else:
+                    failed = mid
+            limit = lower - a
+        else:
+            limit = WIDEN_LIMIT
+
+        # above: same, but not past the window found below, taking in all
+        # remaining anchors if there is none
+        failed = upper
+        step = 1
+        while True:
+            b = upper + step
+            if b - upper > limit:
+                if a is not None:
+                    return (a, upper, anchors[a+1:lower+1] + nids, idx)
+                extend(-1)
+                b = len(anchors)
+            while b >= len(anchors) and extend(max(b - len(anchors) + 1,
+                                                   NEIGHBOURS)):
+                pass
+            b = min(b, len(anchors))
+            if fitsUp(b):
+                break
+            failed = b
+            step *= 2
+        while failed + 1 < b:
+            mid = (failed + b) // 2
+            if fitsUp(mid):
+                b = mid
+            else:
+                failed = mid
+
+        up_cost = b - upper + len(merged(b)) - len(nids)
+        if a is not None and lower - a < up_cost:
+            return (a, upper, anchors[a+1:lower+1] + nids, idx)
+
+        group = list(nids)
+        for t in range(upper, b):
+            group.append(anchors[t])
+            if idx < len(segments) and segments[idx][0] == t:
+                group.extend(segments[idx][2])
+                idx += 1
+        return (lower, b, group, idx)
+
+
+    def insertNear(self, op, nid, dids, after=False):
+        """
+        Create a single note next to an existing note, only looking up
+        and renumbering the neighbours of that note as far as needed
+
+        Arguments:
+
+        - op:    Op, new note or dupe to create
+        - nid:   int, nid of note to insert the new note next to
+        - dids:  list, deck ids whose notes make up the note order
+        - after: boolean, whether to insert after nid instead of before
+
+        Returns ChangeSet
+        """
+        sdids = ids2str(dids)
+        where = "(did in {0} or odid in {0})".format(sdids)
+
+        def following(nid, limit=NEIGHBOURS):
+            return self.col.db.list("select distinct nid from cards "
+                "where nid > ? and " + where + " order by nid limit ?",
+                nid, limit)
+
+        preceding = self.col.db.list("select distinct nid from cards "
+            "where nid < ? and " + where + " order by nid desc limit ?",
+            nid, NEIGHBOURS)
+        preceding.reverse()
+        anchors = preceding + [nid] + following(nid)
+        pos = len(preceding)
+        hunk = Hunk(pos if after else pos - 1, [op])
+        # notes before the first neighbour may only be moved if there
+        # are none in the deck
+        floor = -1 if len(preceding) < NEIGHBOURS else 0
+
+        return self.reorganizeHunks(anchors, [hunk], more=following,
+                                    floor=floor)
+
+
+    def shift(self, nids, start, repos=False):
+        """
+        Fast path for changes that only affect the start date:
+        Shifts all notes by a constant offset if possible, falls back
+        to reorganize otherwise
+
+        Arguments:
+
+        - nids:  list, sorted note IDs as ints
+        - start: int, creation date of first note as UNIX timestamp
+        - repos: boolean, whether to reposition due dates or not
+
+        Returns ChangeSet
+        """
+        if not nids:
+            return ChangeSet(self.nid_map)
+        delta = start * 1000 - nids[0]
+
+        # Check target range for notes that aren't shifted themselves
+        shifted = set(nids)
+        collisions = [nid for nid in self.col.db.list(
+            "select id from notes where id between ? and ?",
+            nids[0] + delta, nids[-1] + delta) if nid not in shifted]
+        if collisions:
+            return self.reorganize(noteOps(nids), start, repos=repos)
+
+        profiler = self.profiler
+        with profiler.phase("nids"):
+            NidRemapper(self.col.db).shift(nids, delta)
+        with profiler.phase("fields"):
+            writer = FieldWriter(self.col)
+            for nid in nids:
+                writer.add(nid + delta, nid)
+                self.nid_map[nid] = nid + delta
+            writer.execute()
+
+        profiler.meta.update(notes=len(nids), shifted=len(nids))
+
+        nidlist = [nid + delta for nid in nids]
+        changes = self.finish(nidlist, repos)
+        changes.shifted = len(nids)
+        return changes
+
+
+    def loadIndex(self, lo=None, hi=None, nids=()):
+        """
+        Load occupied nids once instead of querying them one by one.
+        If bounds are given, only nids within [lo, hi] and the given
+        nids are loaded, see NidIndex.
+        """
+        db = self.col.db
+        with self.profiler.phase("index"):
+            self.index = NidIndex.fromDb(db, lo, hi)
+            for chunk in chunks(list(nids)):
+                self.index.merge(db.list(
+                    "select id from notes where id in " + ids2str(chunk)))
+            self.allocator = NidAllocator(self.index)
+
+
+    def finish(self, nidlist, repos, moved=(), modified=(), created=(),
+               deleted=()):
+        """Reposition cards if requested and return ChangeSet"""
+        if repos:
+            with self.profiler.phase("reposition"):
+                self.reposition(nidlist, [self.nid_map.get(nid, nid)
+                                          for nid in created])
+
+        return ChangeSet(self.nid_map, moved, modified, created, deleted,
+                         self.deleted_cids,
+                         sched=bool(repos or deleted or self.sched_changed))
+
+
+    def findSample(self, ops):
+        """Find first existing note among ops"""
+        for op in ops:
+            if op.kind == ROW_NOTE and self.noteExists(op.nid):
+                return op.nid
+        return None
+
+
+    def processActions(self, ops):
+        """
+        Execute actions among ops (e.g. note creation)
+        Returns nids in the requested order, deleted nids and created nids
+        """
+        processed = []
+        deleted = []
+        requests = []
+        placeholders = {} # position in processed: index in requests
+        last = None
+
+        for idx, op in enumerate(ops):
+            kind = op.kind
+            if kind == ROW_NOTE:
+                # Regular NID, no action
+                processed.append(op.nid)
+                continue
+
+            if kind == ROW_DEL:
+                # Actions: Delete
+                nnid = op.nid
+                if not nnid or not self.noteExists(nnid):
+                    continue
+                # removed in bulk below, but treated as gone from now on
+                self.index.remove(nnid)
+                deleted.append(nnid)
+                continue
+
+            # Actions: New, Dupe, Dupe with Scheduling
+            sched = False
+            ntype = None
+            if kind in (ROW_DUPE, ROW_DUPE_SCHED):
+                sample = op.nid
+                sched = kind == ROW_DUPE_SCHED
+            else:
+                ntype = op.model or MODEL_SAME
+                try:
+                    nxt = ops[idx+1]
+                except IndexError:
+                    nxt = None
+                nxt = nxt.nid if nxt and nxt.kind == ROW_NOTE else None
+                sample = None if last else nxt or self.findSample(ops)
+            if last and not sample:
+                # based on previously created note
+                request = self.prepareNote(last, ntype=ntype)
+            elif sample and self.noteExists(sample):
+                request = self.prepareNote(sample, ntype=ntype, sched=sched)
+            else:
+                continue
+            if not request:
+                continue
+            # placeholder, replaced by nid once the note is created
+            placeholders[len(processed)] = len(requests)
+            processed.append(None)
+            requests.append(request)
+            last = request
+
+        self.removeNotes(deleted)
+        new_nids = self.addNotes(requests)
+        created = [nid for nid in new_nids if nid]
+        for pos, idx in placeholders.items():
+            processed[pos] = new_nids[idx]
+        processed = [nid for nid in processed if nid]
+
+        return processed, deleted, created
+
+
+    def applyPlan(self, plan, created):
+        """Assign new nids as planned, return renumbered existing nids"""
+        with self.profiler.phase("nids"):
+            remapper = NidRemapper(self.col.db)
+            for nid, new_nid in plan.assignments:
+                remapper.add(nid, new_nid)
+            remapper.execute()
+
+        created = set(created)
+        writer = FieldWriter(self.col)
+        modified = []
+        for nid, new_nid in plan.assignments:
+            if nid not in created:
+                modified.append(nid)
+                idnote = False
+            else:
+                idnote = True
+
+            # Store original NID in a predefined field (if available)
+            writer.add(new_nid, nid, idnote=idnote)
+
+            # keep track of moved nids (e.g. for dupes)
+            self.nid_map[nid] = new_nid
+        with self.profiler.phase("fields"):
+            writer.execute()
+
+        return modified
+
+
+    def isVisible(self, cid):
+        """Whether cid is among the preferred sample cards"""
+        if self.visible is None:
+            return False
+        if self.visible_set is None:
+            self.visible_set = set(self.visible)
+        return cid in self.visible_set
+
+
+    def prepareNote(self, sample, ntype=None, sched=False):
+        """
+        Gather information required to create a new note
+
+        Arguments:
+
+        - sample: int, nid of sample note, or request tuple of a
+                  previously prepared note
+        - ntype:  str, note type name, None for dupes
+
+        Returns (sample note, model, did, dupe, sched) request tuple
+        or None if the note can't be created
+        """
+        if isinstance(sample, tuple):
+            # same deck and sample as previous request
+            note, prev_model, sample_did = sample[:3]
+            if not ntype or ntype == MODEL_SAME:
+                model = prev_model
+            else:
+                model = self.col.models.byName(ntype)
+            if not model:
+                return None
+            return (note, model, sample_did, False, False)
+
+        sample_nid = self.nid_map.get(sample, sample)
+        note = self.col.getNote(sample_nid)
+
+        if not self.card:
+            cids = self.col.db.list(
+                    "select id from cards where nid = ? order by ord", sample_nid)
+            try:
+                sample_cid = cids[0]
+            except IndexError:
+                # invalid state: note has no cards
+                return None
+
+            # try to use visible card if available
+            for cid in cids:
+                if self.isVisible(cid):
+                    sample_cid = cid
+                    break
+
+            sample_card = self.col.getCard(sample_cid)
+        else:
+            sample_card = self.card
+
+        # gather model/deck information
+        sample_did = sample_card.odid or sample_card.did # account for dyn decks
+
+        if not ntype or ntype == MODEL_SAME:
+            model = note.model()
+        else:
+            model = self.col.models.byName(ntype)
+        if not model:
+            return None
+
+        return (note, model, sample_did, not ntype, sched)
+
+
+    def addNotes(self, requests):
+        """
+        Create new notes in bulk
+
+        Notes are grouped by model and deck. For each group the deck is
+        only assigned to the model once and the previous default deck of
+        the model is restored afterwards, so that neither the model nor
+        the deck have to be saved.
+
+        Returns list of new nids (None for failed requests)
+        in the order of the prepared requests
+        """
+        groups = OrderedDict()
+        for idx, request in enumerate(requests):
+            key = (request[1]['id'], request[2])
+            groups.setdefault(key, []).append(idx)
+
+        new_nids = [None] * len(requests)
+        copier = SchedulingCopier(self.col.db)
+        for (mid, did), idxs in groups.items():
+            group_model = requests[idxs[0]][1]
+            default_did = group_model['did']
+            group_model['did'] = did
+            try:
+                for idx in idxs:
+                    sample, model, did, dupe, sched = requests[idx]
+                    new_nids[idx] = self.addNote(sample, model, dupe=dupe)
+                    # Copy over scheduling from old cards
+                    if sched and new_nids[idx]:
+                        copier.add(sample.id, new_nids[idx])
+            finally:
+                group_model['did'] = default_did
+        self.sched_changed = bool(copier)
+        copier.execute()
+
+        return new_nids
+
+
+    def addNote(self, sample, model, dupe=False):
+        """Create new note based on sample note"""
+        new_note = Note(self.col, model)
+        new_note.tags = sample.tags
+        if dupe:
+            fields = sample.fields
+        else:
+            # need to fill all fields to avoid notes without cards
+            fields = ["."] * len(new_note.fields)
+        new_note.fields = fields
+        if BACKUP_FIELD in new_note: # skip onid field
+            new_note[BACKUP_FIELD] = ""
+
+        # Add to database
+        if not self.col.addNote(new_note):
+            return None
+        self.index.add(new_note.id)
+
+        return new_note.id
+
+
+    def removeNotes(self, nids):
+        """Remove notes with a single call, index already updated"""
+        if nids:
+            self.deleted_cids = self.col.db.list(
+                "select id from cards where nid in " + ids2str(nids))
+            self.col.remNotes(nids)
+
+
+    def noteExists(self, nid):
+        """Checks the nid index to see whether the nid is actually assigned"""
+        return nid in self.index
+
+
+    def reposition(self, nidlist, created=()):
+        """
+        Order new cards of nidlist by nid, reusing the due positions
+        that existing notes already occupy. Other new cards keep their
+        positions. Cards of created notes share the position of the
+        preceding note, as their own is at the end of the queue.
+        """
+        db = self.col.db
+        cards = {} # nid: [(cid, due)]
+        for chunk in chunks(nidlist):
+            # cards in filtered decks keep their position in odue
+            for cid, nid, due in db.execute(
+                    "select id, nid, due from cards where type = 0 "
+                    "and odid = 0 and nid in " + ids2str(chunk)):
+                cards.setdefault(nid, []).append((cid, due))
+        if not cards:
+            return
+
+        created = set(created)
+        nids = sorted(cards)
+        positions = sorted(min(due for cid, due in cards[nid])
+                           for nid in nids if nid not in created)
+        if not positions:
+            return
+        pool = iter(positions)
+        pos = positions[0]
+        mod = intTime()
+        usn = self.col.usn()
+        updates = []
+        for nid in nids:
+            if nid not in created:
+                pos = next(pool)
+            for cid, due in cards[nid]:
+                if due != pos:
+                    updates.append((pos, mod, usn, cid))
+        db.executemany(
+            "update cards set due=?, mod=?, usn=? where id = ?", updates)
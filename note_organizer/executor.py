@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Bulk database operations
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+from anki.utils import ids2str, intTime, splitFields, joinFields, \
+    stripHTMLMedia, fieldChecksum
+
+from .config import *
+
+# Number of ids to include in a single "in (...)" query
+CHUNK_SIZE = 500
+
+
+def chunks(seq, size=CHUNK_SIZE):
+    """Yield successive slices of seq"""
+    for i in range(0, len(seq), size):
+        yield seq[i:i+size]
+
+
+class NidRemapper(object):
+    """
+    Collects old→new nid assignments and applies all of them
+    to the notes and cards tables at once
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.mapping = []
+
+
+    def __len__(self):
+        return len(self.mapping)
+
+
+    def add(self, nid, new_nid):
+        self.mapping.append((nid, new_nid))
+
+
+    def execute(self):
+        """
+        Apply collected assignments
+
+        Affected rows are first moved to the (otherwise unused) negative
+        nid range. This way chains in which the new nid of one note is
+        the old nid of another note can't collide or get merged.
+
+        Uses executemany instead of a temporary mapping table, as DDL
+        statements would commit the running transaction on Python 2.
+        """
+        if not self.mapping:
+            return
+        db = self.db
+        params = [(-new_nid, nid) for nid, new_nid in self.mapping]
+        db.executemany("update notes set id=? where id = ?", params)
+        db.executemany("update cards set nid=? where nid = ?", params)
+        db.execute("update notes set id=-id where id < 0")
+        db.execute("update cards set nid=-nid where nid < 0")
+        self.mapping = []
+
+
+    def shift(self, nids, delta):
+        """Shift all nids by a constant delta with set-based updates"""
+        db = self.db
+        for chunk in chunks(nids):
+            sids = ids2str(chunk)
+            db.execute("update notes set id=-(id+?) where id in " + sids, delta)
+            db.execute("update cards set nid=-(nid+?) where nid in " + sids,
+                       delta)
+        db.execute("update notes set id=-id where id < 0")
+        db.execute("update cards set nid=-nid where nid < 0")
+
+
+class FieldWriter(object):
+    """
+    Stores original and current nids in the BACKUP_FIELD and
+    NID_FIELD of many notes at once, patching the flds column
+    directly instead of loading and flushing each note
+    """
+
+    def __init__(self, col):
+        self.col = col
+        self.backups = {}
+        self.idnotes = set()
+        self.fieldinfo = {}
+
+
+    def __len__(self):
+        return len(self.backups)
+
+
+    def add(self, nid, onid, idnote=False):
+        """
+        Queue field updates for nid
+
+        - onid:   int, original nid to store in BACKUP_FIELD
+        - idnote: boolean, whether to write nid to NID_FIELD
+        """
+        self.backups[nid] = onid
+        if idnote:
+            self.idnotes.add(nid)
+
+
+    def relevantModels(self):
+        """Return ids of all models with a BACKUP_FIELD or NID_FIELD"""
+        mids = []
+        for model in self.col.models.all():
+            names = self.col.models.fieldNames(model)
+            if BACKUP_FIELD in names or NID_FIELD in names:
+                mids.append(model['id'])
+        return mids
+
+
+    def fieldInfo(self, mid):
+        """Return (backup idx, nid idx, sort idx) for model, cached"""
+        info = self.fieldinfo.get(mid)
+        if info is None:
+            model = self.col.models.get(mid)
+            fmap = self.col.models.fieldMap(model)
+            backup = fmap.get(BACKUP_FIELD, (None,))[0]
+            nidfld = fmap.get(NID_FIELD, (None,))[0]
+            info = (backup, nidfld, self.col.models.sortIdx(model))
+            self.fieldinfo[mid] = info
+        return info
+
+
+    def execute(self):
+        """Write queued fields"""
+        mids = self.relevantModels()
+        if not self.backups or not mids:
+            self.backups = {}
+            self.idnotes = set()
+            return
+        db = self.col.db
+        mod = intTime()
+        usn = self.col.usn()
+        updates = []
+        for chunk in chunks(list(self.backups)):
+            for nid, mid, flds, sfld, csum in db.execute(
+                    "select id, mid, flds, sfld, csum from notes "
+                    "where id in " + ids2str(chunk) +
+                    " and mid in " + ids2str(mids)):
+                backup, nidfld, sortidx = self.fieldInfo(mid)
+                fields = splitFields(flds)
+                patched = []
+                if backup is not None and not fields[backup]:
+                    fields[backup] = str(self.backups[nid])
+                    patched.append(backup)
+                if nidfld is not None and nid in self.idnotes:
+                    fields[nidfld] = str(nid)
+                    patched.append(nidfld)
+                if not patched:
+                    continue
+                # only recompute derived columns if their source changed
+                if sortidx in patched:
+                    sfld = stripHTMLMedia(fields[sortidx])
+                if 0 in patched:
+                    csum = fieldChecksum(fields[0])
+                updates.append((joinFields(fields), sfld, csum, mod, usn, nid))
+        db.executemany(
+            "update notes set flds=?, sfld=?, csum=?, mod=?, usn=? "
+            "where id = ?", updates)
+        self.backups = {}
+        self.idnotes = set()
+
+
+class SchedulingCopier(object):
+    """
+    Copies the scheduling of all cards of sample notes over to the
+    cards of their duplicates without materializing Card objects
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pairs = []
+
+
+    def __len__(self):
+        return len(self.pairs)
+
+
+    def add(self, nid, new_nid):
+        """Queue copying scheduling of nid's cards to new_nid's cards"""
+        self.pairs.append((nid, new_nid))
+
+
+    def execute(self):
+        """Copy scheduling data, matching cards by template order"""
+        if not self.pairs:
+            return
+        db = self.db
+        nids = list(set(nid for pair in self.pairs for nid in pair))
+        cids = {}
+        for chunk in chunks(nids):
+            for nid, cid in db.execute(
+                    "select nid, id from cards where nid in " + ids2str(chunk)
+                    + " order by nid, ord"):
+                cids.setdefault(nid, []).append(cid)
+
+        targets = {} # source cid: target cids
+        for nid, new_nid in self.pairs:
+            for orig, copy in zip(cids.get(nid, ()), cids.get(new_nid, ())):
+                targets.setdefault(orig, []).append(copy)
+
+        updates = []
+        for chunk in chunks(list(targets)):
+            for row in db.execute(
+                    "select id, type, queue, due, ivl, factor, reps, lapses, "
+                    "left from cards where id in " + ids2str(chunk)):
+                for cid in targets[row[0]]:
+                    updates.append(row[1:] + (cid,))
+        db.executemany(
+            "update cards set type=?, queue=?, due=?, ivl=?, "
+            "factor=?, reps=?, lapses=?, left=? where id = ?", updates)
+        self.pairs = []
@@ -16,12 +16,12 @@ from aqt.qt import *
 from aqt import mw
 from aqt.browser import Browser
 from aqt.editor import Editor
-from aqt.utils import askUser
 
 from anki.hooks import addHook, wrap
 
 from .organizer import Organizer
 from .rearranger import Rearranger
+from .ops import Op
 from .config import *
 from .consts import *
 
@@ -30,9 +30,9 @@ from .consts import *
    
 def onBrowserRowChanged(self, current, previous):
     """Sync row position to Organizer"""
-    if not self.organizer:
+    if not self.organizer or not self.card:
         return
-    self.organizer.focusNid(self.card.nid)
+    self.organizer.sync.browserChanged(self.card.nid)
 
 
 def onBrowserNoteDeleted(self, _old):
@@ -52,24 +52,37 @@ def onBrowserClose(self, evt):
         self.organizer.close()
 
 
+def refreshBrowser(browser, changes):
+    """Update browser rows after a reorganization without searching again"""
+    # editor note was loaded before the reorganization and must not be
+    # saved under its old id (cf. Browser.onReset)
+    browser.editor.setNote(None)
+    if changes.created:
+        # cards of new notes have to be sorted into the view
+        browser.search()
+        return
+    m = browser.model
+    m.beginReset() # also drops cached card objects
+    gone = set(changes.deleted_cids)
+    if gone:
+        m.cards = [cid for cid in m.cards if cid not in gone]
+    m.endReset()
+    card = browser.card
+    if not card:
+        return
+    if card.id in gone:
+        browser.card = None
+        return
+    if card.nid in changes.nid_map:
+        card.load()
+    browser.editor.setNote(card.note(reload=True))
+
+
 def onReorganize(self):
     """Invoke Organizer window"""
     if self.organizer:
         self.organizer.show()
         return
-    
-    sel = self.selectedCards()
-    if sel and len(sel) > 1:
-        count = len(sel)
-    else:
-        count = len(self.model.cards)
-    if CARD_COUNT_WARNING and count > CARD_COUNT_WARNING:
-        ret = askUser("Are you sure you want to invoke Note Organizer "
-            "on {} cards? This might take a while".format(count),
-            title="Note Organizer")
-        if not ret:
-            return False
-    
     self.organizer = Organizer(self)
     self.organizer.show()
 
@@ -105,14 +118,14 @@ def onSetNote(self, note, hide=True, focus=False):
 ###### Reviewer
 
 menu_entries = [
-    {"label": "New Note - &before", "cmd": NEW_NOTE, "offset": 0},
-    {"label": "&New Note - after", "cmd": NEW_NOTE, "offset": 1},
-    {"label": "D&uplicate Note - before", "cmd": DUPE_NOTE, "offset": 0},
-    {"label": "&Duplicate Note - after", "cmd": DUPE_NOTE, "offset": 1},
+    {"label": "New Note - &before", "cmd": ROW_NEW, "offset": 0},
+    {"label": "&New Note - after", "cmd": ROW_NEW, "offset": 1},
+    {"label": "D&uplicate Note - before", "cmd": ROW_DUPE, "offset": 0},
+    {"label": "&Duplicate Note - after", "cmd": ROW_DUPE, "offset": 1},
     {"label": "Duplicate Note (with s&cheduling) - before",
-        "cmd": DUPE_NOTE_SCHED, "offset": 0},
+        "cmd": ROW_DUPE_SCHED, "offset": 0},
     {"label": "Duplicate Note (with &scheduling) - after",
-        "cmd": DUPE_NOTE_SCHED, "offset": 1},
+        "cmd": ROW_DUPE_SCHED, "offset": 1},
 ]
 
 
@@ -136,31 +149,21 @@ def onReviewerOrgMenu(command, offset):
     card = mw.reviewer.card
     did = card.odid or card.did # account for dyn decks
     deck = mw.col.decks.nameOrNone(did)
-    note = card.note()
-    nid = note.id
+    nid = card.nid
     
     # rearrange in context of origin deck
     search = "deck:'{}'".format(deck)
-    note_pool = mw.col.findNotes(search)
-    note_pool.sort()
-    try:
-        idx = note_pool.index(nid)
-    except ValueError: # nid not in deck
-        return False
-    
-    # construct command string that imitates Organizer GUI output
-    if command.startswith(NEW_NOTE):
-        data = MODEL_SAME
+    dids = [did] + [child for name, child in mw.col.decks.children(did)]
+
+    if command == ROW_NEW:
+        op = Op(ROW_NEW, model=MODEL_SAME)
     else:
-        data = str(nid)
-    composite = command + ": " + data
-    note_pool.insert(idx + offset, composite)
-    
-    start = None
-    moved = []
+        op = Op(command, nid)
 
     rearranger = Rearranger(card=card)
-    res = rearranger.processNids(note_pool, start, moved)
+    res = rearranger.insertNear(op, nid, dids, after=bool(offset))
+    if res is False:
+        return False
 
     # display result in browser
     if REVIEWER_OPEN_BROWSER:
@@ -170,9 +173,26 @@ def onReviewerOrgMenu(command, offset):
         rearranger.selectNotes(browser, res)
 
 
+###### Change notifications
+
+def onNotesReorganized(changes):
+    """Update open views after a reorganization"""
+    browser = aqt.dialogs._dialogs["Browser"][1]
+    if browser:
+        if browser.organizer:
+            browser.organizer.applyChanges(changes)
+        if not changes.sched: # otherwise reset already
+            refreshBrowser(browser, changes)
+    card = mw.reviewer.card
+    if (not changes.sched and mw.state == "review" and card
+            and card.nid in changes.nid_map):
+        card.load()
+
+
 # Hooks, etc.:
 
 addHook("browser.setupMenus", setupMenu)
+addHook("noteOrganizer.changed", onNotesReorganized)
 Browser.onReorganize = onReorganize
 Browser.organizer = None
 
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+In-memory note ID occupancy index
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+from bisect import bisect_left, bisect_right
+
+# Number of note IDs to load at a time when a lookup leaves the loaded range
+GROW_SIZE = 200
+
+
+class NidIndex(object):
+    """
+    Sorted list of all note IDs that are currently assigned in
+    the collection. Loaded once per reorganization and kept up-to-date
+    by the Rearranger, so that occupancy checks don't have to hit the
+    database.
+
+    Partial indexes only hold the note IDs of a range [lo, hi] and load
+    further ranges from the database as lookups reach beyond them.
+    Note IDs outside of that range are only known if they were merged
+    in explicitly, e.g. those of notes that are going to be moved.
+    """
+
+    def __init__(self, nids=()):
+        self.nids = sorted(nids)
+        self.journal = None # changes since begin(), if recording
+        self.db = None      # database to load missing ranges from
+        self.lo = None      # inclusive bounds of the loaded range,
+        self.hi = None      # None if unbounded
+        self.freed = set()  # removed nids that are still in the database
+
+
+    @classmethod
+    def fromDb(cls, db, lo=None, hi=None):
+        """
+        Load note IDs from the collection database, all of them unless
+        bounds are given
+        """
+        index = cls()
+        if lo is None and hi is None:
+            index.nids = db.list("select id from notes order by id")
+            return index
+        index.db = db
+        index.lo = lo
+        index.hi = hi
+        index.merge(index.query(lo, hi))
+        return index
+
+
+    def query(self, lo, hi):
+        """Return note IDs within [lo, hi] from the database"""
+        if lo is None:
+            return self.db.list("select id from notes where id <= ?", hi)
+        if hi is None:
+            return self.db.list("select id from notes where id >= ?", lo)
+        return self.db.list(
+            "select id from notes where id between ? and ?", lo, hi)
+
+
+    def merge(self, nids):
+        """Mark nids loaded from the database as occupied"""
+        freed = self.freed
+        nids = [nid for nid in nids if nid not in freed]
+        if nids:
+            self.nids = sorted(set(self.nids).union(nids))
+
+
+    def ensure(self, lo, hi):
+        """Make sure all note IDs within [lo, hi] are loaded"""
+        if self.db is None:
+            return
+        if self.lo is not None and (lo is None or lo < self.lo):
+            self.merge(self.query(lo, self.lo - 1))
+            self.lo = lo
+        if self.hi is not None and (hi is None or hi > self.hi):
+            self.merge(self.query(self.hi + 1, hi))
+            self.hi = hi
+        if self.lo is None and self.hi is None:
+            self.db = None # fully loaded
+
+
+    def growUp(self):
+        """Load the next GROW_SIZE note IDs above the loaded range"""
+        nids = self.db.list("select id from notes where id > ? "
+                            "order by id limit ?", self.hi, GROW_SIZE)
+        self.merge(nids)
+        self.ensure(self.lo, nids[-1] if len(nids) == GROW_SIZE else None)
+
+
+    def growDown(self):
+        """Load the next GROW_SIZE note IDs below the loaded range"""
+        nids = self.db.list("select id from notes where id < ? "
+                            "order by id desc limit ?", self.lo, GROW_SIZE)
+        self.merge(nids)
+        self.ensure(nids[-1] if len(nids) == GROW_SIZE else None, self.hi)
+
+
+    def __len__(self):
+        return len(self.nids)
+
+
+    def __contains__(self, nid):
+        nids = self.nids
+        idx = bisect_left(nids, nid)
+        return idx < len(nids) and nids[idx] == nid
+
+
+    def add(self, nid):
+        """Mark nid as occupied"""
+        nids = self.nids
+        idx = bisect_left(nids, nid)
+        if idx < len(nids) and nids[idx] == nid:
+            return
+        nids.insert(idx, nid)
+        self.freed.discard(nid)
+        if self.journal is not None:
+            self.journal.append((nid, True))
+
+
+    def remove(self, nid):
+        """Mark nid as free"""
+        nids = self.nids
+        idx = bisect_left(nids, nid)
+        if idx < len(nids) and nids[idx] == nid:
+            del nids[idx]
+            if self.db is not None:
+                self.freed.add(nid)
+            if self.journal is not None:
+                self.journal.append((nid, False))
+
+
+    def rename(self, nid, new_nid):
+        """Move occupancy from nid to new_nid"""
+        self.remove(nid)
+        self.add(new_nid)
+
+
+    def begin(self):
+        """Start recording changes, so that they can be rolled back"""
+        self.journal = []
+
+
+    def commit(self):
+        """Keep changes since begin()"""
+        self.journal = None
+
+
+    def rollback(self):
+        """Undo changes since begin()"""
+        journal = self.journal
+        self.journal = None
+        for nid, added in reversed(journal):
+            if added:
+                self.remove(nid)
+            else:
+                self.add(nid)
+
+
+    def nextOccupied(self, nid):
+        """Return first occupied nid > nid, or None"""
+        self.ensure(nid, nid)
+        while True:
+            nids = self.nids
+            idx = bisect_right(nids, nid)
+            nxt = nids[idx] if idx < len(nids) else None
+            if self.hi is None or nxt is not None and nxt <= self.hi:
+                return nxt
+            self.growUp()
+
+
+    def prevOccupied(self, nid):
+        """Return last occupied nid < nid, or None"""
+        self.ensure(nid, nid)
+        while True:
+            nids = self.nids
+            idx = bisect_left(nids, nid)
+            prv = nids[idx-1] if idx > 0 else None
+            if self.lo is None or prv is not None and prv >= self.lo:
+                return prv
+            self.growDown()
+
+
+    def nextFree(self, nid):
+        """Return first unassigned nid >= nid"""
+        self.ensure(nid, nid)
+        while True:
+            free = self.nextFreeLoaded(nid)
+            if self.hi is None or free <= self.hi:
+                return free
+            self.growUp()
+
+
+    def prevFree(self, nid):
+        """Return last unassigned nid <= nid"""
+        self.ensure(nid, nid)
+        while True:
+            free = self.prevFreeLoaded(nid)
+            if self.lo is None or free >= self.lo:
+                return free
+            self.growDown()
+
+
+    def nextFreeLoaded(self, nid):
+        """Return first nid >= nid that isn't among the loaded nids"""
+        nids = self.nids
+        start = bisect_left(nids, nid)
+        if start == len(nids) or nids[start] != nid:
+            return nid
+        # nids[i] - i is non-decreasing for sorted unique ints and stays
+        # constant within a run of consecutive nids, so the end of the
+        # run can be found with a binary search
+        key = nids[start] - start
+        lo, hi = start, len(nids) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if nids[mid] - mid == key:
+                lo = mid
+            else:
+                hi = mid - 1
+        return nids[lo] + 1
+
+
+    def prevFreeLoaded(self, nid):
+        """Return last nid <= nid that isn't among the loaded nids"""
+        nids = self.nids
+        end = bisect_right(nids, nid) - 1
+        if end < 0 or nids[end] != nid:
+            return nid
+        # mirror image of nextFree
+        key = nids[end] - end
+        lo, hi = 0, end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if nids[mid] - mid == key:
+                hi = mid
+            else:
+                lo = mid + 1
+        return nids[lo] - 1
+
+
+    def gapAfter(self, nid):
+        """
+        Return number of free nids between nid and the next occupied
+        nid, or None if there is no occupied nid after nid
+        """
+        nxt = self.nextOccupied(nid)
+        if nxt is None:
+            return None
+        return nxt - nid - 1
+
+
+    def gapBefore(self, nid):
+        """
+        Return number of free nids between the previous occupied nid
+        and nid, or None if there is no occupied nid before nid
+        """
+        prv = self.prevOccupied(nid)
+        if prv is None:
+            return None
+        return nid - prv - 1
+
+
+    def countBetween(self, lo, hi):
+        """Return number of occupied nids in the open interval (lo, hi)"""
+        if hi <= lo + 1:
+            return 0
+        self.ensure(lo, hi)
+        nids = self.nids
+        return bisect_left(nids, hi) - bisect_right(nids, lo)
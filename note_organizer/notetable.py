@@ -11,13 +11,373 @@ License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.
 
 from aqt.qt import *
 
-class NoteTable(QTableWidget):
-    """Custom QTableWidget with drag-and-drop support"""
+from .consts import *
+from .columns import MISSING
+from .ops import Op
+
+# Number of rows to render around a row that is scrolled into view
+PREFETCH_BEFORE = 10
+PREFETCH_AFTER = 40
+
+# Column 0 prefixes of action rows
+MARKERS = {
+    ROW_NEW: NEW_NOTE,
+    ROW_DUPE: DUPE_NOTE,
+    ROW_DUPE_SCHED: DUPE_NOTE_SCHED,
+    ROW_DEL: DEL_NOTE
+}
+
+# Column 0 colors of action rows
+COLORS = {
+    ROW_NEW: Qt.darkGreen,
+    ROW_DUPE: Qt.darkBlue,
+    ROW_DUPE_SCHED: Qt.darkBlue,
+    ROW_DEL: Qt.darkRed
+}
+
+
+class NoteModel(QAbstractTableModel):
+    """
+    Table model holding the Organizer rows in compact parallel lists.
+    Cell contents and styles are only generated when requested by the
+    view, using one shared font/brush per row state.
+    """
+
+    def __init__(self, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.kinds = []     # row types (ROW_*)
+        self.nids = []      # nids (source nids for dupes, 0 for new notes)
+        self.ntypes = []    # note type names of new notes, None otherwise
+        self.cids = {}      # nid: cid used to render browser columns
+        self.provider = None
+        self.headers = []
+        self.moved = set()  # nids of interactively moved notes
+        self.rows = {}      # nid: row of regular and deleted notes
+        self.dupes = {}     # nid: rows of dupes of note nid
+        self.dirty = 0      # first row whose entries in self.rows/dupes
+                            # are stale
+        self.fonts = (QFont(), QFont())
+        self.brushes = dict((kind, QBrush(color))
+                            for kind, color in COLORS.items())
+
+
+    def setupFonts(self, family, size):
+        """Set shared regular and bold fonts"""
+        regular = QFont()
+        regular.setFamily(family)
+        regular.setPixelSize(size)
+        bold = QFont(regular)
+        bold.setBold(True)
+        self.fonts = (regular, bold)
+
+
+    def setNotes(self, nids, cids, provider, headers):
+        """
+        Replace all rows with regular note rows
+
+        - nids:     list, nids in display order
+        - cids:     dict, nid: cid to render browser columns of
+        - provider: BrowserColumns instance rendering browser columns
+        - headers:  list, column headers
+        """
+        self.beginResetModel()
+        self.kinds = [ROW_NOTE] * len(nids)
+        self.nids = list(nids)
+        self.ntypes = [None] * len(nids)
+        self.cids = cids
+        self.provider = provider
+        self.headers = headers
+        self.moved = set()
+        self.rows = {}
+        self.dupes = {}
+        self.dirty = 0
+        self.endResetModel()
+
+
+    # Qt model interface
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.kinds)
+
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headers)
+
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            try:
+                return self.headers[section]
+            except IndexError:
+                return None
+        return section + 1
+
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled
+        return (Qt.ItemIsSelectable | Qt.ItemIsEnabled |
+                Qt.ItemIsDragEnabled | Qt.ItemIsDropEnabled)
+
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        col = index.column()
+        kind = self.kinds[row]
+        if role == Qt.DisplayRole:
+            if col == 0:
+                return self.rowText(row)
+            if kind == ROW_NEW:
+                return None
+            return self.columnValue(row, col-1)
+        elif role == Qt.FontRole:
+            bold = (col == 0 and kind != ROW_NOTE or
+                    kind == ROW_NOTE and self.nids[row] in self.moved)
+            return self.fonts[bold]
+        elif role == Qt.ForegroundRole:
+            if col == 0:
+                return self.brushes.get(kind)
+        return None
+
+
+    # Row access
+
+    def rowText(self, row):
+        """Return column 0 text of row, i.e. nid or action marker"""
+        kind = self.kinds[row]
+        if kind == ROW_NOTE:
+            return u"{}".format(self.nids[row])
+        if kind == ROW_NEW:
+            return u"{}: {}".format(MARKERS[kind], self.ntypes[row])
+        return u"{}: {}".format(MARKERS[kind], self.nids[row])
+
+
+    def ops(self):
+        """Return rows as list of Op tuples"""
+        return [Op(*row) for row in zip(self.kinds, self.nids, self.ntypes)]
+
+
+    def columnValue(self, row, col):
+        """
+        Return browser column value of row, rendering it and the values
+        of the surrounding rows if it isn't cached yet
+        """
+        cid = self.cids.get(self.nids[row])
+        if not cid or not self.provider:
+            return None
+        value = self.provider.get(cid, col)
+        if value is MISSING:
+            first = max(0, row - PREFETCH_BEFORE)
+            last = min(len(self.nids), row + PREFETCH_AFTER)
+            cids = [self.cids.get(nid) for nid in self.nids[first:last]]
+            self.provider.fetch([c for c in cids if c])
+            value = self.provider.get(cid, col)
+        return value if value is not MISSING else None
+
+
+    def findNid(self, nid):
+        """Return row of regular or deleted note nid, or None"""
+        # entries of moved or removed notes aren't purged, verify them
+        # instead and only bring the index up to date if they are stale
+        row = self.rows.get(nid)
+        if not self.isRow(row, nid, (ROW_NOTE, ROW_DEL)):
+            if self.dirty == len(self.kinds):
+                return None
+            self.updateRows()
+            row = self.rows.get(nid)
+            if not self.isRow(row, nid, (ROW_NOTE, ROW_DEL)):
+                return None
+        return row
+
+
+    def findDupes(self, nid):
+        """Return rows of dupes of note nid"""
+        if self.dirty < len(self.kinds):
+            self.updateRows()
+        return [row for row in self.dupes.get(nid, ())
+                if self.isRow(row, nid, (ROW_DUPE, ROW_DUPE_SCHED))]
+
+
+    def isRow(self, row, nid, kinds):
+        return (row is not None and row < len(self.kinds)
+                and self.nids[row] == nid and self.kinds[row] in kinds)
+
+
+    def invalidateRows(self, row):
+        """Mark nid index as stale from row onwards"""
+        self.dirty = min(self.dirty, row)
+
+
+    def updateRows(self):
+        """Bring nid index up to date, starting at first stale row"""
+        rows = self.rows
+        dupes = self.dupes
+        kinds = self.kinds
+        nids = self.nids
+        for row in range(self.dirty, len(kinds)):
+            kind = kinds[row]
+            if kind in (ROW_NOTE, ROW_DEL):
+                rows[nids[row]] = row
+            elif kind != ROW_NEW:
+                dupes.setdefault(nids[row], set()).add(row)
+        self.dirty = len(kinds)
+
+
+    def emitRowChanged(self, row):
+        self.dataChanged.emit(self.index(row, 0),
+                              self.index(row, len(self.headers) - 1))
+
+
+    # Row manipulation
+
+    def insertAction(self, row, kind, nid=0, ntype=None):
+        """Insert action row (new note or dupe) before row"""
+        self.invalidateRows(row)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.kinds.insert(row, kind)
+        self.nids.insert(row, nid)
+        self.ntypes.insert(row, ntype)
+        self.endInsertRows()
+
+
+    def removeRowList(self, rows):
+        """Remove rows from table"""
+        if not rows:
+            return
+        self.invalidateRows(min(rows))
+        for row in sorted(rows, reverse=True):
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.kinds[row]
+            del self.nids[row]
+            del self.ntypes[row]
+            self.endRemoveRows()
+
+
+    def removeNids(self, nids):
+        """Remove rows of notes nids and of dupes created from them"""
+        nids = set(nids)
+        rows = []
+        for nid in nids:
+            row = self.findNid(nid)
+            if row is not None:
+                rows.append(row)
+            rows.extend(self.findDupes(nid))
+        # removed back to front, index stale from the first one onwards
+        self.removeRowList(rows)
+        for nid in nids:
+            self.cids.pop(nid, None)
+            self.moved.discard(nid)
+        return rows
+
+
+    def refreshNids(self, nids):
+        """Redraw rows of notes nids"""
+        for nid in nids:
+            row = self.findNid(nid)
+            if row is not None:
+                self.emitRowChanged(row)
+
+
+    def renumber(self, nid_map):
+        """Replace nids of renumbered notes, including those of dupes"""
+        if not nid_map:
+            return
+        nids = self.nids
+        for row, nid in enumerate(nids):
+            new_nid = nid_map.get(nid)
+            if new_nid is not None:
+                nids[row] = new_nid
+                self.emitRowChanged(row)
+        self.cids = dict((nid_map.get(nid, nid), cid)
+                         for nid, cid in self.cids.items())
+        self.moved = set(nid_map.get(nid, nid) for nid in self.moved)
+        self.rows = {}
+        self.dupes = {}
+        self.dirty = 0
+
+
+    def setKind(self, row, kind):
+        """Change type of row, e.g. to apply deletion marks"""
+        self.kinds[row] = kind
+        self.emitRowChanged(row)
+
+
+    def moveBlock(self, first, last, dest):
+        """Move contiguous rows first..last to position before row dest"""
+        if first <= dest <= last + 1: # already in place
+            return
+        if not self.beginMoveRows(QModelIndex(), first, last,
+                                  QModelIndex(), dest):
+            return
+        ins = dest if dest < first else dest - (last - first + 1)
+        for values in (self.kinds, self.nids, self.ntypes):
+            block = values[first:last+1]
+            del values[first:last+1]
+            values[ins:ins] = block
+        self.invalidateRows(min(first, dest))
+        self.endMoveRows()
+
+
+    def moveRowList(self, rows, dest):
+        """
+        Move rows to position before row dest, keeping their order
+
+        Non-contiguous selections are moved as one block per run of
+        adjacent rows. Returns first row of the moved rows.
+        """
+        rows = sorted(rows)
+        if not rows:
+            return dest
+        runs = []
+        for row in rows:
+            if runs and runs[-1][1] == row - 1:
+                runs[-1][1] = row
+            else:
+                runs.append([row, row])
+
+        # gather runs in front of dest back to front, then the ones
+        # behind dest front to back. Runs spanning dest stay in place.
+        before = [(first, min(last, dest - 1)) for first, last in runs
+                  if first < dest]
+        after = [(max(first, dest), last) for first, last in runs
+                 if last >= dest]
+        target = dest
+        for first, last in reversed(before):
+            self.moveBlock(first, last, target)
+            target -= last - first + 1
+        pos = target
+        target = dest
+        for first, last in after:
+            self.moveBlock(first, last, target)
+            target += last - first + 1
+
+        for row in range(pos, pos + len(rows)):
+            if self.kinds[row] == ROW_NOTE:
+                self.moved.add(self.nids[row])
+        return pos
+
+
+class NoteTable(QTableView):
+    """Custom QTableView with drag-and-drop support"""
     # adapted from http://stackoverflow.com/a/26311179
     def __init__(self, dialog):
-        QTableWidget.__init__(self)
+        QTableView.__init__(self)
 
         self.dialog = dialog
+        self.notes = NoteModel(self)
+        self.setModel(self.notes)
         self.setDragEnabled(True)
         self.setAcceptDrops(True)
         self.viewport().setAcceptDrops(True)
@@ -30,59 +390,35 @@ class NoteTable(QTableWidget):
 
         self.setEditTriggers(QAbstractItemView.NoEditTriggers)
 
-        self.moved = []
+
+    @property
+    def moved(self):
+        return self.notes.moved
 
 
     def dropEvent(self, event):
         if event.source() == self and (event.dropAction() == Qt.MoveAction 
                         or self.dragDropMode() == QAbstractItemView.InternalMove):
             success, row, col, topIndex = self.dropOn(event)
-            if success:             
-                selRows = self.getSelectedRows()                        
-
-                top = selRows[0]
-                dropRow = row
-                if dropRow == -1:
-                    dropRow = self.rowCount()
-                offset = dropRow - top
-
-                for i, row in enumerate(selRows):
-                    r = row + offset
-                    if r > self.rowCount() or r < 0:
-                        r = 0
-                    self.insertRow(r)
-
+            if success:
                 selRows = self.getSelectedRows()
-
-                top = selRows[0]
-                offset = dropRow - top                
-                for i, row in enumerate(selRows):
-                    r = row + offset
-                    if r > self.rowCount() or r < 0:
-                        r = 0
-
-                    for col in range(self.columnCount()):
-                        dupe = QTableWidgetItem(self.item(row, col))
-                        font = dupe.font()
-                        font.setBold(True)
-                        dupe.setFont(font)
-                        self.setItem(r, col, dupe)
-                        if col == 0:
-                            value = dupe.text()
-                            if value not in self.moved:
-                                self.moved.append(value)
-
+                if row == -1:
+                    row = self.notes.rowCount()
+                self.notes.moveRowList(selRows, row)
+                # rows are moved by the model already, prevent the view
+                # from removing the drag source
+                event.setDropAction(Qt.CopyAction)
                 event.accept()
 
         else:
-            QTableView.dropEvent(event)                
+            QTableView.dropEvent(self, event)
 
 
     def getSelectedRows(self):
         sel = self.selectionModel().selectedRows()
         if not sel:
             return None
-        return [i.row() for i in sel]
+        return sorted(i.row() for i in sel)
 
 
     def droppingOnItself(self, event, index):
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Edit operations passed from the Organizer to the Rearranger
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+from collections import namedtuple
+
+from .consts import *
+
+
+class Op(namedtuple("Op", ("kind", "nid", "model"))):
+    """
+    Single entry of a requested note order
+
+    - kind:  int, row type (ROW_*)
+    - nid:   int, nid of note, source nid for dupes, 0 for new notes
+    - model: str, note type name of new notes, None otherwise
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, kind, nid=0, model=None):
+        return super(Op, cls).__new__(cls, kind, nid, model)
+
+
+def noteOps(nids):
+    """Return ops that keep existing notes in the order of nids"""
+    return [Op(ROW_NOTE, nid) for nid in nids]
+
+
+class Hunk(namedtuple("Hunk", ("anchor", "ops"))):
+    """
+    Run of changed rows between two unchanged notes
+
+    - anchor: int, index of the preceding unchanged note in the anchor
+              list, -1 if the hunk is at the top
+    - ops:    list, Op tuples of the hunk in the requested order
+    """
+
+    __slots__ = ()
+
+
+def diffOps(ops, moved):
+    """
+    Split ops into the nids of unchanged notes (anchors) and hunks of
+    changed rows. Notes count as unchanged unless they are part of
+    moved or marked for deletion.
+
+    Returns (anchors, hunks)
+    """
+    anchors = []
+    hunks = []
+    current = None
+    for op in ops:
+        if op.kind == ROW_NOTE and op.nid not in moved:
+            anchors.append(op.nid)
+            current = None
+            continue
+        if current is None:
+            current = Hunk(len(anchors) - 1, [])
+            hunks.append(current)
+        current.ops.append(op)
+    return anchors, hunks
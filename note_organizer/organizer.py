@@ -9,21 +9,32 @@ Copyright: (c) Glutanimate 2017
 License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
 """
 
-# from timeit import default_timer as timer
-
 from anki.hooks import addHook, remHook
 
 from aqt.qt import *
 
+from anki.utils import ids2str, intTime
+
 from aqt.utils import saveHeader, restoreHeader, saveGeom, \
     restoreGeom, askUser, tooltip, askUser
 
 from .forms import organizer
 from .notetable import NoteTable
 from .rearranger import Rearranger
+from .columns import BrowserColumns
+from .sync import SelectionSync
+from .executor import chunks
+from .profiler import Profiler
+from .ops import diffOps
 from .config import *
 from .consts import *
 
+# Number of cards to resolve per event loop iteration while loading
+LOAD_CHUNK_SIZE = 2000
+
+# Delay in ms used to merge consecutive collection resets into one refresh
+RESET_DELAY = 100
+
 
 class Organizer(QDialog):
     """Main dialog"""
@@ -34,37 +45,50 @@ class Organizer(QDialog):
         self.f = organizer.Ui_Dialog()
         self.f.setupUi(self)
         self.table = NoteTable(self)
+        self.notes = self.table.notes
         self.hh = self.table.horizontalHeader()
         self.f.tableLayout.addWidget(self.table)
         self.oldnids = []
+        self.first = None
         self.clipboard = []
         self.modified = False
+        self.pending = []   # cids that still need to be loaded
+        self.loaded = {}    # nid: cid of notes loaded so far
+        self.loading = False
+        self.loaded_at = 0  # time of last load or refresh
+        self.profiler = Profiler("organizer", self.mw.col)
+        self.columns = BrowserColumns(browser)
+        self.sync = SelectionSync(self)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(RESET_DELAY)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.load_timer = QTimer(self)
+        self.load_timer.setSingleShot(True)
+        self.load_timer.setInterval(0)
+        self.load_timer.timeout.connect(self.loadChunk)
         self.setupUi()
         addHook("reset", self.onReset)
 
 
     def setupUi(self):
-        # print("=====Performance benchmark=====")
-        # start = timer()
-        self.fillTable()
-        # end = timer()
-        # print("total", end - start)    
         self.setupDate()
-        self.updateDate()
         self.setupHeaders()
         restoreGeom(self, "organizer")
         self.setupEvents()
         self.table.setFocus()
-        # focus currently selected card:
-        if self.browser.card:
-            self.focusNid(str(self.browser.card.nid))
+        self.fillTable()
 
     def setupEvents(self):
         """Connect event signals to slots"""
         self.table.selectionModel().selectionChanged.connect(self.onRowChanged)
-        self.table.cellChanged.connect(self.onCellChanged)
+        for signal in (self.notes.dataChanged, self.notes.rowsInserted,
+                       self.notes.rowsRemoved, self.notes.layoutChanged,
+                       self.notes.modelReset):
+            signal.connect(self.onTableChanged)
         self.f.buttonBox.rejected.connect(self.onReject)
         self.f.buttonBox.accepted.connect(self.onAccept)
+        self.f.btnStopLoading.clicked.connect(self.onStopLoading)
 
         self.table.setContextMenuPolicy(Qt.CustomContextMenu)
         self.table.customContextMenuRequested.connect(self.onTableContext)
@@ -139,89 +163,128 @@ class Organizer(QDialog):
 
 
     def fillTable(self):
-        """Fill table rows with data"""
+        """
+        Start filling table rows with data. Cards are resolved to notes
+        in chunks on the event loop, so that the dialog stays responsive.
+        Rows are set in one go once all notes are resolved, column data
+        is only rendered once rows are shown.
+        """
         b = self.browser
         m = b.model
-        t = self.table
-
-        data = []
-        notes = []
-        nids = []
-        mcol = m.activeCols
-        mcolcnt = len(m.activeCols)
 
         # either get selected cards or entire view
         sel = b.selectedCards()
-        if sel and len(sel) > 1:
-            # need to map nids to actually selected row indexes
-            idxs = b.form.tableView.selectionModel().selectedRows()
-        else:
+        if not sel or len(sel) < 2:
             sel = m.cards
-            idxs = None
-
-        # eliminate duplicates, get data, and sort it by nid
-        # start = timer()
-        for row, cid in enumerate(sel):
-            if idxs:
-                row = idxs[row].row()
-            c = m.cardObjs.get(cid, None)
-            if not c:
-                c = m.col.getCard(cid)
-                m.cardObjs[cid] = c
-            nid = c.note().id
-            if nid in nids:
-                continue
-            data_row = [str(nid)]
-            for col in range(mcolcnt):
-                index = m.index(row, col)
-                data_row.append(m.data(index, Qt.DisplayRole))
-            nids.append(nid)
-            data.append(data_row)
-        data.sort()
-        self.oldnids = [i[0] for i in data]
-
-        # end = timer()
-        # print("getdata", end - start) 
-
-        # set table data
-        # start = timer()
+        self.columns.invalidate()
+
         coldict = dict(b.columns)
-        headers = ["Note ID"] + [coldict[key] for key in mcol]
-        row_count = len(data)
-        t.setRowCount(row_count)
-        t.setColumnCount(len(headers))
-        t.setHorizontalHeaderLabels(headers)
+        headers = ["Note ID"] + [coldict[key] for key in m.activeCols]
+        self.notes.setupFonts(b.mw.fontFamily, b.mw.fontHeight)
+        self.notes.setNotes([], {}, self.columns, headers)
+        self.oldnids = []
+        self.loaded_at = intTime()
 
-        for row, columns in enumerate(data):
-            for col, value in enumerate(columns):
-                item = QTableWidgetItem(value)
-                f = QFont()
-                f.setFamily(b.mw.fontFamily)
-                f.setPixelSize(b.mw.fontHeight)
-                item.setFont(f)
-                t.setItem(row,col,item)
+        self.pending = list(sel)
+        self.loaded = {}
+        self.f.progress.setRange(0, len(self.pending))
+        self.f.progress.setValue(0)
+        self.setLoading(True)
+        self.profiler.start()
+        self.load_timer.start()
 
-        # end = timer()
-        # print("setdata", end - start)
 
-        self.setWindowTitle("Reorganize Notes ({} notes shown)".format(row_count))
+    def loadChunk(self):
+        """Resolve next chunk of cards to their notes"""
+        if not self.loading: # cancelled or dialog closed
+            return
+        chunk = self.pending[:LOAD_CHUNK_SIZE]
+        del self.pending[:LOAD_CHUNK_SIZE]
+
+        # resolve nids and eliminate duplicates
+        with self.profiler.phase("gather"):
+            card_nids = {}
+            for sub in chunks(chunk):
+                card_nids.update(self.mw.col.db.all(
+                    "select id, nid from cards where id in " + ids2str(sub)))
+            loaded = self.loaded
+            for cid in chunk:
+                nid = card_nids.get(cid)
+                if nid is None or nid in loaded:
+                    continue
+                loaded[nid] = cid # first card shown for note
+
+        self.f.progress.setValue(self.f.progress.value() + len(chunk))
+        self.setWindowTitle("Reorganize Notes (loading {} notes...)".format(
+            len(self.loaded)))
+        if self.pending and len(self.loaded) >= 2 * len(self.notes.nids):
+            # show the notes loaded so far, re-sorting them only whenever
+            # their number doubled so that sorting stays linearithmic
+            with self.profiler.phase("populate"):
+                self.showLoaded()
+        if self.pending:
+            self.load_timer.start()
+        else:
+            self.finishLoading()
+
+
+    def showLoaded(self):
+        """Replace table rows with the notes loaded so far"""
+        self.notes.setNotes(sorted(self.loaded), self.loaded,
+                            self.columns, self.notes.headers)
+
+
+    def finishLoading(self, cancelled=False):
+        """Show the notes loaded so far and enable editing"""
+        self.load_timer.stop()
+        self.pending = []
+        with self.profiler.phase("populate"):
+            self.showLoaded()
+        self.loaded = {}
+        self.oldnids = list(self.notes.nids)
+        self.setLoading(False)
+        self.profiler.meta["cancelled"] = cancelled
+        self.profiler.stop()
+        title = "Reorganize Notes ({} notes shown)".format(len(self.oldnids))
+        if cancelled:
+            title += " - loading stopped"
+        self.setWindowTitle(title)
+        self.updateDate()
+        # focus currently selected card:
+        if self.browser.card:
+            self.focusNid(str(self.browser.card.nid))
+
+
+    def setLoading(self, loading):
+        """Toggle progress display and disable editing while loading"""
+        self.loading = loading
+        self.f.progress.setVisible(loading)
+        self.f.btnStopLoading.setVisible(loading)
+        self.f.buttonBox.button(QDialogButtonBox.Ok).setEnabled(not loading)
+        self.table.setDragEnabled(not loading)
 
 
-    def onCellChanged(self, row, col):
+    def onStopLoading(self):
+        """Stop loading, keeping the rows that were loaded already"""
+        if self.loading:
+            self.finishLoading(cancelled=True)
+
+
+    def onTableChanged(self, *args):
         """Update datetime display when (0,0) changed"""
-        if row == col == 0:
+        first = self.notes.rowText(0) if self.notes.rowCount() else None
+        if first != self.first:
             self.updateDate()
 
 
     def updateDate(self):
         """Update datetime based on (0,0) value"""
-        item = self.table.item(0, 0)
-        if not item:
+        if not self.notes.rowCount():
             return False
-        try:
-            nid = int(item.text())
-        except ValueError:
+        self.first = self.notes.rowText(0)
+        if self.notes.kinds[0] != ROW_NOTE:
             return False
+        nid = self.notes.nids[0]
         timestamp = nid / 1000
         qtime = QDateTime()
         qtime.setTime_t(timestamp)
@@ -269,88 +332,61 @@ class Organizer(QDialog):
 
     def onInsertNote(self, model=None):
         """Insert marker for new note"""
+        if self.loading:
+            return
         rows = self.table.getSelectedRows()
         if not rows:
             return
         row = rows[0] + 1
-        self.table.insertRow(row)
         if not model:
             model = MODEL_SAME
-        data = u"{}: {}".format(NEW_NOTE, model)
-        item = QTableWidgetItem(data)
-        font = item.font()
-        font.setBold(True)
-        item.setFont(font)
-        item.setForeground(Qt.darkGreen)
-        self.table.setItem(row, 0, item)
+        self.notes.insertAction(row, ROW_NEW, ntype=model)
         self.modified = True
 
 
     def onDuplicateNote(self, sched=False):
         """Insert marker for duplicated note"""
+        if self.loading:
+            return
         rows = self.table.getSelectedRows()
         if not rows:
             return
         row = rows[0]
-        new_row = row+1
-        self.table.insertRow(new_row)
-        marker = DUPE_NOTE if not sched else DUPE_NOTE_SCHED
-        for col in range(self.table.columnCount()):
-            if col == 0:
-                value = self.table.item(row, 0).text()
-                nid = ''.join(i for i in value if i.isdigit())
-                if value.startswith(DEL_NOTE) or not nid:
-                    self.table.removeRow(new_row)
-                    return
-                data = u"{}: {}".format(marker, nid)
-                dupe = QTableWidgetItem(data)
-                font = dupe.font()
-                font.setBold(True)
-                dupe.setFont(font)
-                dupe.setForeground(Qt.darkBlue)
-            else:
-                dupe = QTableWidgetItem(self.table.item(row, col))
-            self.table.setItem(new_row, col, dupe)
+        kind = self.notes.kinds[row]
+        if kind in (ROW_DEL, ROW_NEW):
+            return
+        marker = ROW_DUPE if not sched else ROW_DUPE_SCHED
+        self.notes.insertAction(row + 1, marker, nid=self.notes.nids[row])
         self.modified = True
 
 
     def onRemoveNotes(self):
         """Remove empty row(s)"""
+        if self.loading:
+            return
         rows = self.table.getSelectedRows()
         if not rows:
             return
         to_remove = []
-        delmark = u"{}: ".format(DEL_NOTE)
         for row in rows:
-            item = self.table.item(row, 0)
-            if not item:
-                continue
-            value = item.text()
+            kind = self.notes.kinds[row]
             # New notes:
-            if value.startswith((NEW_NOTE, DUPE_NOTE)): # remove
+            if kind in (ROW_NEW, ROW_DUPE, ROW_DUPE_SCHED): # remove
                 to_remove.append(row)
                 continue
             # Existing notes:
-            if value.startswith(delmark): # remove deletion mark
-                new = value.replace(delmark, "")
-                item.setText(u"{}".format(new))
-                font = item.font()
-                font.setBold(False)
-                item.setFont(font)
-                item.setForeground(QBrush())
+            if kind == ROW_DEL: # remove deletion mark
+                self.notes.setKind(row, ROW_NOTE)
             else: # apply deletion mark
-                item.setText(u"{}: {}".format(DEL_NOTE, value))
-                font = item.font()
-                font.setBold(True)
-                item.setFont(font)
-                item.setForeground(Qt.darkRed)
-        for row in to_remove[::-1]: # in reverse to avoid updating idxs
-            self.table.removeRow(row)
+                self.notes.setKind(row, ROW_DEL)
+        self.notes.removeRowList(to_remove)
         self.modified = True
 
 
     def onCutRow(self):
         """Store current selection in clipboard"""
+        if self.loading:
+            return
         rows = self.table.getSelectedRows()
         if not rows:
             return
@@ -359,11 +395,9 @@ class Organizer(QDialog):
 
     def onPasteRow(self):
         """Paste current selection"""
-        # TODO: Needs some refactoring
-
         t = self.table
         cut = self.clipboard
-        if not self.clipboard:
+        if not self.clipboard or self.loading:
             return
         
         rows = self.table.getSelectedRows()
@@ -371,47 +405,26 @@ class Organizer(QDialog):
             return
         
         new_row = rows[0]
-        if new_row == cut[0] or new_row in range(cut[0], cut[-1]+1):
-            # return if source and target identical
-            # FIXME: support pasting back into the same range
-            return False
+        if cut[0] <= new_row <= cut[-1]:
+            # pasting into the cut range itself: new_row becomes the
+            # first row of the pasted block, i.e. the block is inserted
+            # before the (new_row)th row that isn't part of it
+            dest = new_row
+            for row in cut:
+                if row > dest:
+                    break
+                dest += 1
+            dest = min(dest, self.notes.rowCount())
+        else:
+            dest = new_row
 
-        # Insert new row and copy data over
-        offset = 0
-        cols = t.columnCount()
-        select = []
-        for cut_row in cut[::-1]:
-            t.insertRow(new_row)
-            if new_row < cut_row:
-                offset += 1
-            adj_row = cut_row + offset
-            # print("moving {} (actual: {}) to {}".format(
-            #         cut_row+1, adj_row+1, new_row+1))
-            for col in range(cols):
-                dupe = QTableWidgetItem(t.item(adj_row, col))
-                font = dupe.font()
-                font.setBold(True)
-                dupe.setFont(font)
-                t.setItem(new_row, col, dupe)
-                if col == 0:
-                    value = dupe.text()
-                    if value not in t.moved:
-                        t.moved.append(value)
-            t.clearSelection()
-
-        # Remove old row
-        for row in cut[::-1]:
-            # print("removing {}".format(row+offset))
-            t.removeRow(row+offset)
+        pos = self.notes.moveRowList(cut, dest)
 
         # reselect moved rows
+        t.clearSelection()
         selectionModel = t.selectionModel()
-        if new_row > cut[0]:
-            index1 = t.model().index(new_row-len(cut), 0)
-            index2 = t.model().index(new_row-1, 2)
-        else:
-            index1 = t.model().index(new_row, 0)
-            index2 = t.model().index(new_row+len(cut)-1, 0)
+        index1 = self.notes.index(pos, 0)
+        index2 = self.notes.index(pos+len(cut)-1, 0)
         itemSelection = QItemSelection(index1, index2)
         selectionModel.select(itemSelection, 
             QItemSelectionModel.Rows | QItemSelectionModel.Select)
@@ -427,48 +440,89 @@ class Organizer(QDialog):
         rows = self.table.getSelectedRows()
         if not rows:
             return
-        item = self.table.item(rows[0], 0)
-        if not item:
+        nid = self.notes.nids[rows[0]]
+        if not nid: # ignore new note markers
             return
-        nid = item.text()
-        if ": " in nid: # ignore action markers
-            nid = nid.split(": ")[1]
-        cids = self.mw.col.db.list(
-                "select id from cards where nid = ? order by ord", nid)
-        for cid in cids:
-            if cid in self.browser.model.cards:
-                self.browser.focusCid(cid)
-                break
+        self.sync.organizerChanged(nid)
 
 
     def deleteNids(self, nids):
-        """Find and delete row by note ID"""
-        for nid in nids:
-            nid = str(nid)
-            cells = self.table.findItems(nid, Qt.MatchEndsWith)
-            if cells:
-                row = cells[0].row()
-                self.table.removeRow(row)
+        """Find and delete rows by note ID"""
+        nids = set(int(nid) for nid in nids)
+        if not self.notes.removeNids(nids):
+            return
+        self.oldnids = [nid for nid in self.oldnids if nid not in nids]
+        self.clipboard = [] # row numbers are out of date
 
 
     def focusNid(self, nid):
         """Find and select row by note ID"""
-        nid = str(nid)
-        cells = self.table.findItems(nid, Qt.MatchEndsWith)
-        if cells:
-            self.table.setCurrentItem(cells[0])
+        row = self.notes.findNid(int(nid))
+        if row is not None:
+            self.table.setCurrentIndex(self.notes.index(row, 0))
 
 
     def onReset(self):
-        self.clipboard = []
-        self.fillTable()
-        self.updateDate()
-        if self.browser.card:
-            self.focusNid(str(self.browser.card.nid))
+        """Refresh once resets stop coming in"""
+        self.refresh_timer.start()
+
+
+    def refresh(self):
+        """
+        Update rows of notes that were modified or deleted since the
+        table was loaded, keeping pending edits
+        """
+        self.sync.invalidate()
+        if self.loading: # nothing was edited yet, start over
+            self.finishLoading(cancelled=True)
+            self.fillTable()
+            return
+        db = self.mw.col.db
+        since = self.loaded_at
+        self.loaded_at = intTime()
+
+        # deleted and modified notes and cards, looked up by the ids of
+        # the shown notes as mod isn't indexed. Same-second edits are
+        # picked up again by the next refresh, hence >=
+        shown = self.notes.cids
+        existing = set()
+        nids = set()
+        cids = []
+        for chunk in chunks(list(shown)):
+            sids = ids2str(chunk)
+            for nid, mod in db.execute(
+                    "select id, mod from notes where id in " + sids):
+                existing.add(nid)
+                if mod >= since:
+                    nids.add(nid)
+            for cid, nid in db.execute("select id, nid from cards "
+                    "where nid in " + sids + " and mod >= ?", since):
+                nids.add(nid)
+                cids.append(cid)
+        self.deleteNids([nid for nid in shown if nid not in existing])
+        self.columns.forget(cids)
+        self.columns.forget(shown[nid] for nid in nids)
+        self.notes.refreshNids(nids)
+
+
+    def applyChanges(self, changes):
+        """Update rows after a reorganization, e.g. from the reviewer"""
+        nid_map = changes.nid_map
+        self.sync.invalidate()
+        self.columns.forget(self.notes.cids[nid] for nid in nid_map
+                            if nid in self.notes.cids)
+        self.notes.renumber(nid_map)
+        self.oldnids = [nid_map.get(nid, nid) for nid in self.oldnids]
+        if changes.deleted:
+            self.deleteNids(changes.deleted)
 
 
     def cleanup(self):
         remHook("reset", self.onReset)
+        self.refresh_timer.stop()
+        self.sync.stop()
+        if self.loading:
+            self.finishLoading(cancelled=True)
         self.browser.organizer = None
         saveGeom(self, "organizer")
         saveHeader(self.hh, "organizer")
@@ -487,28 +541,25 @@ class Organizer(QDialog):
 
     def onAccept(self):
         """Ask for confirmation, then call rearranger"""
-        newnids = []
-        for row in range(self.table.rowCount()):
-            item = self.table.item(row, 0)
-            if not item: # should not happen
-                continue
-            newnids.append(item.text())
+        notes = self.notes
+        start = self.getDate()
+        repos = self.f.cbRepos.isChecked()
 
-        if newnids == self.oldnids:
-            self.close()
-            tooltip("No changes performed")
-            return False
+        kinds = notes.kinds
+        # action rows other than deletion marks change the row count
+        if notes.nids == self.oldnids and ROW_DEL not in kinds:
+            nids = self.oldnids
+            if not nids or not start or start == nids[0] // 1000:
+                self.close()
+                tooltip("No changes performed")
+                return False
+            return self.onDateShifted(nids, start, repos)
 
-        moved = []
-        for i in self.table.moved:
-            try:
-                moved.append(int(i))
-            except ValueError: # only add existing notes to moved
-                pass
+        ops = notes.ops()
+        moved = list(self.table.moved)
 
-        nn = newnids
-        to_delete = len([i for i in nn if i.startswith(DEL_NOTE)])
-        to_add = len([i for i in nn if i.startswith((NEW_NOTE, DUPE_NOTE))])
+        to_delete = kinds.count(ROW_DEL)
+        to_add = len(kinds) - kinds.count(ROW_NOTE) - to_delete
         to_move = len(moved)
 
         if not ASK_CONFIRMATION:
@@ -525,14 +576,41 @@ class Organizer(QDialog):
                 parent=self, defaultno=True, title="Please confirm action")
             if not ret:
                 return False
-          
-        start = self.getDate() # TODO: identify cases where only date modified
-        repos = self.f.cbRepos.isChecked()
 
+        # only process changed rows unless the start date was changed.
+        # Repositioning needs to see all notes of the view.
+        hunks = None
+        first = ops[0]
+        if not repos and first.kind == ROW_NOTE and (
+                not start or start == first.nid // 1000):
+            anchors, hunks = diffOps(ops, set(moved))
+            if any(a >= b for a, b in zip(anchors, anchors[1:])):
+                hunks = None # unchanged notes out of order
+
+        self.cleanup()
         rearranger = Rearranger(browser=self.browser)
-        rearranger.processNids(newnids, start, moved, repos=repos)
+        if hunks is not None:
+            rearranger.processHunks(anchors, hunks, moved, repos=repos)
+        else:
+            rearranger.processNids(ops, start, moved, repos=repos)
+
+        super(Organizer, self).accept()
+
+
+    def onDateShifted(self, nids, start, repos):
+        """Shift all notes when only the start date was modified"""
+        if ASK_CONFIRMATION:
+            ret = askUser("Change the creation date of all <b>{}</b> "
+                "note(s) to start at the selected date?<br><br>"
+                "Are you sure you want to <b>proceed</b>?".format(len(nids)),
+                parent=self, defaultno=True, title="Please confirm action")
+            if not ret:
+                return False
 
         self.cleanup()
+        rearranger = Rearranger(browser=self.browser)
+        rearranger.shiftNids(list(nids), start, repos=repos)
+
         super(Organizer, self).accept()
 
 
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Note ID planning stage
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+from bisect import bisect_left
+
+from .allocator import GapExhausted
+
+
+class Plan(object):
+    """Renumbering steps required to achieve a given note order"""
+
+    def __init__(self):
+        # final nids in the requested order
+        self.nidlist = []
+        # (nid, new_nid) tuples in the requested order
+        self.assignments = []
+
+
+    def __len__(self):
+        return len(self.assignments)
+
+
+class Planner(object):
+    """
+    Computes a Plan that keeps the longest increasing subsequence of
+    existing nids in place and only assigns new nids to the remaining
+    notes, using the gaps between the fixed notes
+    """
+
+    def __init__(self, allocator):
+        self.allocator = allocator
+        self.index = allocator.index
+
+
+    def plan(self, nids, start=None, moved=(), lower=None, upper=None,
+             created=(), keep=True):
+        """
+        Arguments:
+
+        - nids:  list, note IDs in the requested order
+        - start: int, creation date of first note as UNIX timestamp
+        - moved: iterable, nids that should preferably be renumbered
+                 if there are multiple ways to achieve the same order
+        - lower, upper: int, exclusive bounds for all nids of the plan,
+                 e.g. unchanged notes surrounding nids. Raises
+                 GapExhausted if the notes don't fit in between.
+        - created: iterable, nids of notes created for this plan. Their
+                 nids only reflect the time of creation, so they are
+                 always renumbered.
+        - keep:  boolean, whether to keep an increasing subsequence of
+                 nids in place. Otherwise all notes are spread across
+                 the free space between the bounds, which always
+                 succeeds if there is enough of it.
+        """
+        index = self.index
+        nids = [nid for nid in nids if nid in index] # skip deleted notes
+        plan = Plan()
+        if not nids:
+            return plan
+
+        # list of (position, nid) of notes whose nid needs to be kept.
+        # Fixed notes act as anchors for the remaining ones.
+        fixed = []
+        floor = lower
+        created = set(created)
+        if start and start != nids[0] // 1000:
+            # first nid, date changed
+            index.remove(nids[0])
+            first = index.nextFree(start * 1000)
+            index.add(first)
+            fixed.append((0, first))
+            floor = first
+            candidates = range(1, len(nids))
+        else:
+            candidates = range(len(nids))
+        # keep created notes as anchors only if there is nothing else
+        candidates = ([pos for pos in candidates if nids[pos] not in created]
+                      or candidates)
+        if not keep:
+            candidates = []
+
+        fixed.extend(self.increasingSubsequence(
+            nids, candidates, floor, moved, upper))
+
+        new_nids = list(nids)
+        for pos, nid in fixed:
+            new_nids[pos] = nid
+
+        # release nids of all notes that are going to be renumbered,
+        # so that they can be reused by other notes
+        fixed_positions = set(pos for pos, nid in fixed)
+        for pos, nid in enumerate(nids):
+            if pos not in fixed_positions:
+                index.remove(nid)
+
+        # assign nids to all notes between two fixed notes, widening
+        # the window by releasing anchors whenever a gap is too small
+        lo = lower
+        run_start = 0
+        idx = 0
+        while idx <= len(fixed):
+            if idx < len(fixed):
+                run_end, hi = fixed[idx]
+            else:
+                run_end, hi = len(nids), upper
+            count = run_end - run_start
+            if count:
+                try:
+                    assigned = self.allocator.spread(lo, hi, count)
+                except GapExhausted:
+                    if idx == len(fixed): # can't move past upper bound
+                        raise
+                    # treat anchor as part of the run
+                    index.remove(hi)
+                    idx += 1
+                    continue
+                new_nids[run_start:run_end] = assigned
+            lo = hi
+            run_start = run_end + 1
+            idx += 1
+
+        plan.assignments = [(nid, new_nid) for nid, new_nid
+                                in zip(nids, new_nids) if nid != new_nid]
+        plan.nidlist = new_nids
+        return plan
+
+
+    def increasingSubsequence(self, nids, candidates, floor, moved,
+                              ceiling=None):
+        """
+        Return (position, nid) tuples of the longest strictly increasing
+        subsequence of nids among the candidate positions, only
+        considering floor < nids < ceiling. Ties are broken in favour of
+        notes that are not part of moved.
+        """
+        moved = set(moved)
+        positions = [pos for pos in candidates
+                        if (floor is None or nids[pos] > floor) and
+                           (ceiling is None or nids[pos] < ceiling)]
+        if not positions:
+            return []
+
+        # maximize number of fixed notes first, unmoved notes second
+        bonus_base = len(positions) + 1
+        ranks = sorted(set(nids[pos] for pos in positions))
+        size = len(ranks)
+        # Fenwick tree holding (best weight, position) prefix maxima
+        tree = [(0, -1)] * (size + 1)
+        prev = {}
+
+        for pos in positions:
+            nid = nids[pos]
+            rank = bisect_left(ranks, nid) # 0-based, strictly smaller
+            best = (0, -1)
+            i = rank
+            while i > 0:
+                if tree[i] > best:
+                    best = tree[i]
+                i -= i & -i
+            weight = bonus_base + (0 if nid in moved else 1)
+            entry = (best[0] + weight, pos)
+            prev[pos] = best[1]
+            i = rank + 1
+            while i <= size:
+                if entry > tree[i]:
+                    tree[i] = entry
+                i += i & -i
+
+        best = (0, -1)
+        i = size
+        while i > 0:
+            if tree[i] > best:
+                best = tree[i]
+            i -= i & -i
+
+        result = []
+        pos = best[1]
+        while pos != -1:
+            result.append((pos, nids[pos]))
+            pos = prev[pos]
+        result.reverse()
+        return result
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Phase-level profiling
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+import os
+import json
+import time
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+from .config import *
+
+
+class NullPhase(object):
+    """Shared no-op phase used while profiling is disabled"""
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class CountingDB(object):
+    """
+    Proxy around an Anki DB object that counts the SQL statements
+    executed through it. Everything else is passed through.
+    """
+
+    _own = ("_proxied", "statements")
+
+    def __init__(self, db):
+        object.__setattr__(self, "_proxied", db)
+        object.__setattr__(self, "statements", 0)
+
+
+    def __getattr__(self, name):
+        return getattr(self._proxied, name)
+
+
+    def __setattr__(self, name, value):
+        if name in self._own:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._proxied, name, value)
+
+
+    def changes(self):
+        """Total number of rows modified on the underlying connection"""
+        return self._proxied._db.total_changes
+
+
+    def _counted(name):
+        def method(self, *args, **kwargs):
+            self.statements += 1
+            return getattr(self._proxied, name)(*args, **kwargs)
+        method.__name__ = name
+        return method
+
+    execute = _counted("execute")
+    scalar = _counted("scalar")
+    all = _counted("all")
+    first = _counted("first")
+    list = _counted("list")
+    executescript = _counted("executescript")
+
+    def executemany(self, sql, l):
+        # each parameter set executes the statement once
+        l = list(l) if not isinstance(l, (list, tuple)) else l
+        self.statements += len(l)
+        return self._proxied.executemany(sql, l)
+
+    del _counted
+
+
+class Phase(object):
+    """Measures a single named phase of a profiled run"""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+
+    def __enter__(self):
+        db = self.profiler.db
+        self.start = timer()
+        self.statements = db.statements if db else 0
+        self.changes = db.changes() if db else 0
+        return self
+
+
+    def __exit__(self, *args):
+        db = self.profiler.db
+        self.profiler.record(self.name, timer() - self.start,
+            db.statements - self.statements if db else 0,
+            db.changes() - self.changes if db else 0)
+        return False
+
+
+class Profiler(object):
+    """
+    Records wall time, SQL statement counts and modified rows for
+    named phases of a run and writes them to a JSON report
+
+    Disabled profilers (see PROFILING) and phases outside of a run
+    hand out a shared no-op phase, so instrumented code paths stay
+    cheap.
+
+    Usage:
+
+        profiler = Profiler("reorganize", col)
+        with profiler:
+            with profiler.phase("plan"):
+                ...
+    """
+
+    def __init__(self, name, col=None, enabled=None, folder=None):
+        self.name = name
+        self.col = col
+        self.enabled = PROFILING if enabled is None else enabled
+        self.folder = folder
+        self.active = False
+        self.db = None
+        self.phases = OrderedDict()
+        self.meta = {}
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+
+    def start(self):
+        """Begin run, prefer using the profiler as a context manager"""
+        if self.enabled and not self.active:
+            self.active = True
+            self.started = time.time()
+            self.timer = timer()
+            if self.col is not None:
+                self.db = CountingDB(self.col.db)
+                self.col.db = self.db
+                self.changes = self.db.changes()
+        return self
+
+
+    def stop(self):
+        """End run and write report"""
+        if not self.active:
+            return
+        self.total = timer() - self.timer
+        self.statements = self.rows = 0
+        if self.db is not None:
+            self.statements = self.db.statements
+            self.rows = self.db.changes() - self.changes
+            self.col.db = self.db._proxied
+        self.save()
+        self.db = None
+        self.active = False
+
+
+    def phase(self, name):
+        """Return context manager measuring phase 'name'"""
+        if not self.active:
+            return NULL_PHASE
+        return Phase(self, name)
+
+
+    def record(self, name, duration, statements, rows):
+        """Accumulate measurements, phases might run more than once"""
+        entry = self.phases.get(name)
+        if entry is None:
+            entry = self.phases[name] = OrderedDict(
+                (("time", 0.0), ("statements", 0), ("rows", 0), ("calls", 0)))
+        entry["time"] += duration
+        entry["statements"] += statements
+        entry["rows"] += rows
+        entry["calls"] += 1
+
+
+    def report(self):
+        """Return report as a dictionary"""
+        return OrderedDict((
+            ("run", self.name),
+            ("started", self.started),
+            ("time", self.total),
+            ("statements", self.statements),
+            ("rows", self.rows),
+            ("meta", self.meta),
+            ("phases", self.phases)
+        ))
+
+
+    def save(self):
+        """Write JSON report to folder or PROFILING_DIR"""
+        folder = self.folder or PROFILING_DIR or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "profiles")
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        path = os.path.join(folder, "{}-{}.json".format(
+            self.name, time.strftime("%Y%m%d-%H%M%S",
+                                     time.localtime(self.started))))
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        return path
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file is part of the Note Organizer add-on for Anki
+
+Selection synchronization between Browser and Organizer
+
+Copyright: (c) Glutanimate 2017
+License: GNU AGPL, version 3 or later; https://www.gnu.org/licenses/agpl-3.0.en.html
+"""
+
+from aqt.qt import *
+
+# Delay in ms used to coalesce bursts of selection changes (~1 frame)
+SYNC_INTERVAL = 16
+
+
+class SelectionSync(QObject):
+    """
+    Forwards selection changes between Browser and Organizer.
+
+    Changes are collected and only the most recent one is applied once
+    the event loop has been idle for SYNC_INTERVAL, so that holding down
+    an arrow key doesn't result in a round trip per row. Selection changes
+    caused by applying a change aren't forwarded back to their origin.
+    """
+
+    def __init__(self, organizer, interval=SYNC_INTERVAL):
+        QObject.__init__(self, organizer)
+        self.organizer = organizer
+        self.browser = organizer.browser
+        self.pending = None # (target, nid)
+        self.applying = False
+        self.card_ids = {}  # nid: cids ordered by template
+        self.cards = None   # browser card list self.rows was built for
+        self.rows = {}      # cid: browser row
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+
+    def browserChanged(self, nid):
+        """Browser row changed, focus nid in Organizer"""
+        self.schedule("organizer", nid)
+
+
+    def organizerChanged(self, nid):
+        """Organizer row changed, focus nid in Browser"""
+        self.schedule("browser", nid)
+
+
+    def schedule(self, target, nid):
+        if self.applying: # echo of our own change
+            return
+        self.pending = (target, nid)
+        self.timer.start() # restarts running timer
+
+
+    def flush(self):
+        """Apply most recent selection change"""
+        if not self.pending:
+            return
+        target, nid = self.pending
+        self.pending = None
+        self.applying = True
+        try:
+            if target == "organizer":
+                self.organizer.focusNid(nid)
+            else:
+                self.focusBrowser(nid)
+        finally:
+            self.applying = False
+
+
+    def stop(self):
+        self.timer.stop()
+        self.pending = None
+
+
+    def invalidate(self):
+        """Forget cached cards, e.g. after a collection reset"""
+        self.card_ids = {}
+        self.cards = None
+        self.rows = {}
+
+
+    def cidsOf(self, nid):
+        """Return cids of nid ordered by template, cached"""
+        cids = self.card_ids.get(nid)
+        if cids is None:
+            cids = self.browser.mw.col.db.list(
+                "select id from cards where nid = ? order by ord", nid)
+            self.card_ids[nid] = cids
+        return cids
+
+
+    def browserRows(self):
+        """Return cid: row map of cards shown in the browser"""
+        cards = self.browser.model.cards
+        if cards is not self.cards or len(cards) != len(self.rows):
+            self.cards = cards
+            self.rows = dict((cid, row) for row, cid in enumerate(cards))
+        return self.rows
+
+
+    def focusBrowser(self, nid):
+        """Select first card of nid that is shown in the browser"""
+        rows = self.browserRows()
+        cards = self.cards
+        for cid in self.cidsOf(nid):
+            row = rows.get(cid)
+            if row is not None and cards[row] == cid:
+                # same as browser.focusCid, without its list search
+                self.browser.form.tableView.selectRow(row)
+                break